@@ -1,4 +1,4 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #=============================================================================
 # Copyright   : (c) 2008-2012 semantics GmbH. All Rights Reserved.
@@ -40,13 +40,8 @@ setup_info = dict(
         "Natural Language :: English",
         "Operating System :: OS Independent",
         "Programming Language :: Python",
-        "Programming Language :: Python :: 2",
-        "Programming Language :: Python :: 2.6",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.1",
-        "Programming Language :: Python :: 3.2",
-        "Programming Language :: Python :: 3.3",
+        "Programming Language :: Python :: 3 :: Only",
         "Topic :: Communications",
         "Topic :: Software Development :: Libraries :: Python Modules",
         "Topic :: Text Processing :: General",
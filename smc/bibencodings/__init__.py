@@ -14,14 +14,20 @@
 import codecs
 from smc.bibencodings import iso5426
 from smc.bibencodings import marc
+from smc.bibencodings import variants
+from smc.bibencodings.textio import open
 
 
 def search_func(encoding):
+    # Python 3.9+ normalizes hyphens to underscores
+    encoding = encoding.replace('_', '-')
     if encoding in set(['iso-5426', 'iso5426', 'mab2']):
         return iso5426.codecInfo
     if encoding in set(['iso-5426-xe0', 'iso5426-xe0', 'mab2-xe0']):
         return iso5426.specialXE0CodecInfo
     if encoding in set(["marc", "usmarc", "ansel"]):
         return marc.codecInfo
+    # registered variants, see smc.bibencodings.variants
+    return variants.search_func(encoding)
 
 codecs.register(search_func)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : asyncio stream decoding
+#=============================================================================
+"""asyncio stream decoding
+
+StreamDecoder wraps an asyncio.StreamReader and decodes the payload of
+Z39.50 / SRU connections::
+
+    reader, writer = await asyncio.open_connection(host, port)
+    decoder = StreamDecoder(reader, "mab2")
+    async for record in decoder.records():
+        ...
+
+Chunks of at least *threshold* bytes are decoded in an executor so large
+records don't block the event loop.
+"""
+import asyncio
+import codecs
+import functools
+from smc.bibencodings.utils import RECORD_TERMINATOR
+
+
+class StreamDecoder(object):
+    """Decode text and records from an asyncio.StreamReader
+
+    Use either read() / async iteration for text or readrecord() / records()
+    for records, but don't mix both on one decoder.
+    """
+
+    def __init__(self, reader, encoding='mab2', errors='strict',
+                 chunksize=65536, threshold=16384, executor=None,
+                 terminator=RECORD_TERMINATOR):
+        self._reader = reader
+        self._codec = codecs.lookup(encoding)
+        self._decoder = self._codec.incrementaldecoder(errors)
+        self.errors = errors
+        self.chunksize = chunksize
+        self.threshold = threshold
+        self.executor = executor
+        self.terminator = terminator
+
+    async def _run(self, func, data, *args):
+        """Run func(data, *args), offload large data to the executor
+        """
+        if self.threshold is not None and len(data) >= self.threshold:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, data, *args))
+        return func(data, *args)
+
+    async def read(self, n=-1):
+        """Read up to n bytes and return them decoded
+
+        Returns an empty string at EOF. Combining chars at the end of a chunk
+        are kept until the char they modify has been received.
+        """
+        while True:
+            data = await self._reader.read(n)
+            final = not data
+            text = await self._run(self._decoder.decode, data, final)
+            if text or final:
+                return text
+
+    async def readrecord(self):
+        """Read and decode one record including its terminator
+
+        Returns an empty string at EOF. A trailing record without terminator
+        is returned as well.
+        """
+        reader = self._reader
+        chunks = []
+        while True:
+            try:
+                chunks.append(await reader.readuntil(self.terminator))
+                break
+            except asyncio.IncompleteReadError as e:
+                chunks.append(e.partial)
+                break
+            except asyncio.LimitOverrunError as e:
+                # record is larger than the reader's buffer limit
+                chunks.append(await reader.readexactly(e.consumed))
+        data = b"".join(chunks)
+        if not data:
+            return ""
+        text, consumed = await self._run(self._codec.decode, data, self.errors)
+        return text
+
+    async def records(self):
+        """Iterate over decoded records
+        """
+        while True:
+            record = await self.readrecord()
+            if not record:
+                break
+            yield record
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        text = await self.read(self.chunksize)
+        if not text:
+            raise StopAsyncIteration
+        return text
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : decode cache
+#=============================================================================
+"""decode cache
+
+Field values like publisher names, series titles, subject headings and
+coded fields repeat across records. DecodeCache memoizes the decoded text
+of short values in a bounded LRU cache::
+
+    cache = DecodeCache("mab2")
+    fields = decode_mab2_fields(record, cache.decode)
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+from functools import lru_cache
+
+
+class DecodeCache(object):
+    """Bounded LRU cache in front of a codec's decode function
+
+    Values longer than *maxlength* bytes are decoded without caching.
+    """
+
+    def __init__(self, encoding='mab2', errors='strict', maxsize=8192,
+                 maxlength=256):
+        self.encoding = codecs.lookup(encoding).name
+        self.errors = errors
+        self.maxlength = maxlength
+        self.uncached = 0
+        self._decode = codecs.lookup(encoding).decode
+        self._cached = lru_cache(maxsize)(self._decode_uncached)
+
+    def _decode_uncached(self, data):
+        return self._decode(data, self.errors)[0]
+
+    def decode(self, data):
+        """Decode data, returns text
+        """
+        if len(data) > self.maxlength:
+            self.uncached += 1
+            return self._decode(data, self.errors)[0]
+        return self._cached(bytes(data))
+
+    @property
+    def hits(self):
+        return self._cached.cache_info().hits
+
+    @property
+    def misses(self):
+        return self._cached.cache_info().misses
+
+    @property
+    def currsize(self):
+        return self._cached.cache_info().currsize
+
+    def clear(self):
+        """Clear cache and statistics
+        """
+        self._cached.cache_clear()
+        self.uncached = 0
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : canonical byte form
+#=============================================================================
+"""canonical byte form
+
+ISO-5426 has two combining diaeresis (0xc8 and 0xc9) and the decoder
+accepts char + combining char sequences that aren't in the charmap. Such
+variants decode to the same text but have different bytes.
+canonicalize() rewrites every char the decoder recognizes with the bytes the
+encoder writes for it, so equal text means equal bytes::
+
+    canonicalize(b"\\xc9a") == canonicalize(b"\\xc8a") == b"\\xc8a"
+
+The transcoding works on bytes with precompiled tables, no text is
+created. The result decodes to the same text as data. A combining char that
+isn't followed by a matching char is decoded on its own, the decoder makes
+that choice from the next two bytes. These bytes are copied, e.g. the 0xc9
+in b"\\xc8\\xc2\\xc9u" stays.
+
+Chars of the special 0xe0 map are written as ISO-5426 sequences where
+ISO-5426 has one (0xe4 becomes 0xc8 a), 0xa4 and 0xf7 have none and are
+copied. Decode the canonical form of mab2-xe0 data with mab2-xe0.
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings.validate import get_validator
+
+# codec name -> transcode function, table factory, check for valid data
+# that is already canonical
+_codecs = {
+    'iso-5426': (lambda data, tables, errors: iso5426.transcode(
+                     data, tables, errors, lookahead=True),
+                 lambda: iso5426.transcode_tables(_iso5426_encode),
+                 # 0xc9 is an alias of 0xc8
+                 lambda data: b"\xc9" not in data),
+    'iso-5426-xe0': (lambda data, tables, errors: iso5426.transcode(
+                         data, tables, errors, lookahead=True),
+                     lambda: iso5426.transcode_tables(
+                         _iso5426_encode, iso5426.special_xe0_map),
+                     None),
+    'marc': (marc.transcode,
+             lambda: marc.transcode_tables(_marc_encode),
+             # MARC-8 has exactly one byte form per char
+             lambda data: True),
+    }
+
+_tables = {}
+
+
+def _iso5426_encode(text):
+    try:
+        return iso5426.encode(text)[0]
+    except UnicodeError:
+        # chars of the special 0xe0 map without ISO-5426 sequence
+        return None
+
+
+def _marc_encode(text):
+    return marc.encode(text)[0]
+
+
+def canonical_tables(encoding):
+    """Return the cached transcode tables of a codec
+    """
+    name = codecs.lookup(encoding).name
+    tables = _tables.get(name)
+    if tables is None:
+        if name not in _codecs:
+            raise LookupError("Unsupported encoding %s" % encoding)
+        tables = _tables[name] = _codecs[name][1]()
+    return tables
+
+
+def canonicalize(data, encoding='mab2', errors='strict'):
+    """Return the canonical byte form of data
+
+    errors: strict raises UnicodeError for undecodable bytes, ignore drops
+      them, replace writes '?' and repr writes \\xNN.
+    """
+    name = codecs.lookup(encoding).name
+    if name not in _codecs:
+        raise LookupError("Unsupported encoding %s" % encoding)
+    transcode, factory, canonical = _codecs[name]
+    if canonical is not None:
+        data = bytes(data)
+        if canonical(data) and get_validator(name).is_valid(data):
+            return data
+    return transcode(data, canonical_tables(name), errors)[0]
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : compressed input
+#=============================================================================
+"""compressed input
+
+open_compressed() opens gzip, bzip2 and xz compressed files as well as
+uncompressed files for reading. The format is detected from the magic
+bytes. A background thread reads and decompresses large blocks ahead while
+the caller decodes the previous block. zlib, bz2 and lzma release the GIL
+so decompression and decoding overlap::
+
+    with open_compressed("delivery.mab.gz") as f:
+        for record in iter_records(f):
+            ...
+"""
+from __future__ import unicode_literals, print_function
+import gzip
+import os
+import queue
+import threading
+try:
+    import bz2
+except ImportError: # pragma: no cover
+    bz2 = None
+try:
+    import lzma
+except ImportError: # pragma: no cover
+    lzma = None
+
+BLOCKSIZE = 1 << 20
+
+# magic bytes, name, open function for a file name or file object
+FORMATS = [(b"\x1f\x8b", "gzip", gzip.open)]
+if bz2 is not None:
+    FORMATS.append((b"BZh", "bzip2", bz2.open))
+if lzma is not None:
+    FORMATS.append((b"\xfd7zXZ\x00", "xz", lzma.open))
+
+
+def detect_compression(fileobj):
+    """Return the compression format of a binary file or None
+
+    The file must support peek() or seek(), the position is not changed.
+    """
+    if hasattr(fileobj, "peek"):
+        head = fileobj.peek(6)[:6]
+    else:
+        pos = fileobj.tell()
+        head = fileobj.read(6)
+        fileobj.seek(pos)
+    for magic, name, opener in FORMATS:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+class ReadAhead(object):
+    """Read blocks of a binary stream in a background thread
+
+    Up to *queuesize* blocks of *blocksize* bytes are read ahead. read()
+    returns at most one block, a short read is not an end of file.
+    """
+
+    def __init__(self, stream, blocksize=BLOCKSIZE, queuesize=2,
+                 closestream=True):
+        self.stream = stream
+        self.blocksize = blocksize
+        self.closestream = closestream
+        self.closed = False
+        self._queue = queue.Queue(queuesize)
+        self._stop = False
+        self._block = b""
+        self._pos = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._reader)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reader(self):
+        read = self.stream.read
+        put = self._queue.put
+        try:
+            while not self._stop:
+                block = read(self.blocksize)
+                put(block)
+                if not block:
+                    break
+        except Exception as e:
+            put(e)
+
+    def _next_block(self):
+        block = self._queue.get()
+        if isinstance(block, Exception):
+            self._eof = True
+            raise block
+        if not block:
+            self._eof = True
+        self._block = block
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if size is None or size < 0:
+            chunks = [self._block[self._pos:]]
+            while not self._eof:
+                self._next_block()
+                chunks.append(self._block)
+            self._block = b""
+            self._pos = 0
+            return b"".join(chunks)
+        if self._pos >= len(self._block):
+            if self._eof:
+                return b""
+            self._next_block()
+        pos = self._pos
+        if pos == 0 and size >= len(self._block):
+            # hand out the whole block without copying
+            self._pos = len(self._block)
+            return self._block
+        self._pos = pos + size
+        return self._block[pos:pos + size]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop = True
+        # unblock the reader thread
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        self._thread.join()
+        if self.closestream:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_compressed(source, readahead=True, blocksize=BLOCKSIZE, queuesize=2):
+    """Open a gzip, bzip2, xz or uncompressed file for binary reading
+
+    source is a file name or a binary file object. A file object is not
+    closed. With *readahead* a ReadAhead reader thread decompresses the next
+    blocks in the background.
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, "rb") as f:
+            name = detect_compression(f)
+        closestream = True
+    else:
+        name = detect_compression(source)
+        closestream = False
+    for magic, fmt, opener in FORMATS:
+        if fmt == name:
+            stream = opener(source, "rb")
+            # the decompressor owns its state but not a file object source
+            closestream = True
+            break
+    else:
+        stream = open(source, "rb") if closestream else source
+    if readahead:
+        return ReadAhead(stream, blocksize, queuesize, closestream)
+    return stream
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : synthetic corpus
+#=============================================================================
+"""synthetic corpus
+
+CorpusGenerator builds MAB2 or MARC records for benchmarks. The field
+layout and the words are taken from the records in testdata, accented and
+double combined chars come from the unicodemap of the codec. The output
+depends only on the seed and the options::
+
+    with open("corpus.mab", "wb") as f:
+        CorpusGenerator("mab2", seed=42).write(f, size=2 << 30)
+
+or ``python -m smc.bibencodings.corpus corpus.mab --size 2G``.
+
+MARC records reuse the MAB2 tags, data fields get blank indicators and
+subfield a.
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import os
+import random
+from glob import glob
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings.records import iter_mab2_fields
+from smc.bibencodings.utils import CharTables
+from smc.bibencodings.writers import MAB2Writer, MARCWriter
+
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "testdata")
+
+# format -> codec module, writer class
+FORMATS = {
+    'mab2': (iso5426, MAB2Writer),
+    'marc': (marc, MARCWriter),
+    }
+
+
+def _load_testdata():
+    """Return the field layouts and the words of the MAB2 test records
+    """
+    layouts = []
+    words = set()
+    for name in sorted(glob(os.path.join(TESTDATA, "record_?.mab"))):
+        with open(name, "rb") as f:
+            record = f.read()
+        layout = []
+        for tag, indicator, value in iter_mab2_fields(record):
+            value = value.decode("mab2")
+            layout.append((tag.decode("ascii"), indicator.decode("ascii"),
+                           len(value)))
+            words.update(value.split())
+        layouts.append(layout)
+    return layouts, sorted(words)
+
+
+class CorpusGenerator(object):
+    """Deterministic generator of synthetic records
+
+    accents: probability that a word gets an accented char
+    doubles: probability that a word gets a double combined char
+    record_size: (min, max) approximate size of a record in bytes
+    error_rate: probability that a field gets an undecodable byte
+    """
+
+    def __init__(self, format='mab2', seed=0, accents=0.05, doubles=0.002,
+                 record_size=(300, 1500), error_rate=0.0):
+        if format not in FORMATS:
+            raise ValueError("Unsupported format %s" % format)
+        self.format = format
+        self.codec, self.writer = FORMATS[format]
+        self.random = random.Random(seed)
+        self.accents = accents
+        self.doubles = doubles
+        self.record_size = record_size
+        self.error_rate = error_rate
+        self.records = 0
+        combining = self.codec._combining
+        unicodemap = self.codec.unicodemap
+        self.layouts, words = _load_testdata()
+        self.words = [w for w in words if all(c in unicodemap for c in w)]
+        # precomposed chars that encode as combining prefix + base char
+        self.accented = sorted(u for u, s in unicodemap.items()
+                               if len(u) == 1 and len(s) == 2 and
+                               s[0] in combining and s[1] not in combining)
+        self.double = sorted(u for u, s in unicodemap.items()
+                             if len(u) == 1 and len(s) == 3 and
+                             s[0] in combining and s[1] in combining)
+        tables = CharTables(self.codec.charmap)
+        self.invalid = [bytes(bytearray([b])) for b in range(0x80, 0x100)
+                        if tables.single[b] is None and b not in combining]
+
+    def word(self):
+        rnd = self.random
+        word = rnd.choice(self.words)
+        if rnd.random() < self.accents:
+            pos = rnd.randrange(len(word))
+            word = word[:pos] + rnd.choice(self.accented) + word[pos + 1:]
+        if self.double and rnd.random() < self.doubles:
+            pos = rnd.randrange(len(word))
+            word = word[:pos] + rnd.choice(self.double) + word[pos + 1:]
+        return word
+
+    def value(self, length):
+        """Return a field value of about length chars
+        """
+        words = []
+        size = 0
+        word = self.word
+        while size < length:
+            w = word()
+            words.append(w)
+            size += len(w) + 1
+        return " ".join(words)
+
+    def fields(self):
+        """Return the fields of the next record
+        """
+        rnd = self.random
+        layout = rnd.choice(self.layouts)
+        target = rnd.randint(*self.record_size)
+        self.records += 1
+        fields = [("001", " ", "GEN%09i" % self.records)]
+        # tag, indicator and terminator, MARC adds a directory entry
+        overhead = 5 if self.format == 'mab2' else 17
+        size = 24 + 12 + overhead
+        i = 1
+        while size < target:
+            tag, indicator, length = layout[i % len(layout)]
+            i += 1
+            if tag == "001":
+                continue
+            length = max(1, int(length * rnd.uniform(0.5, 1.5)))
+            fields.append((tag, indicator, self.value(length)))
+            size += length + overhead
+        if self.format == 'marc':
+            fields = [(tag, "", value) if tag < "010"
+                      else (tag, "  ", "\x1fa" + value)
+                      for tag, indicator, value in fields]
+        return fields
+
+    def _encode_into(self, input, buffer, errors='strict'):
+        result = self.codec.encode_into(input, buffer, errors)
+        if self.error_rate and self.random.random() < self.error_rate:
+            buffer += self.random.choice(self.invalid)
+        return result
+
+    def write(self, stream, size=None, records=None):
+        """Write records until size bytes or a number of records are written
+
+        Returns (records, bytes).
+        """
+        if size is None and records is None:
+            raise ValueError("size or records required")
+        writer = self.writer(stream, encode_into=self._encode_into)
+        count = total = 0
+        while ((size is None or total < size) and
+               (records is None or count < records)):
+            total += writer.write(self.fields())
+            count += 1
+        writer.close()
+        return count, total
+
+
+def _size(value):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    value = value.upper()
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m smc.bibencodings.corpus",
+        description="generate a synthetic MAB2 or MARC corpus")
+    parser.add_argument("output")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="mab2")
+    parser.add_argument("--size", type=_size, default=_size("100M"),
+                        help="approximate size, e.g. 500M or 2G")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--accents", type=float, default=0.05)
+    parser.add_argument("--doubles", type=float, default=0.002)
+    parser.add_argument("--min-record-size", type=int, default=300)
+    parser.add_argument("--max-record-size", type=int, default=1500)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    options = parser.parse_args(args)
+    generator = CorpusGenerator(options.format, options.seed, options.accents,
+                                options.doubles,
+                                (options.min_record_size,
+                                 options.max_record_size),
+                                options.error_rate)
+    with open(options.output, "wb") as f:
+        count, total = generator.write(f, size=options.size)
+    print("%i records, %i bytes" % (count, total))
+
+
+if __name__ == "__main__": # pragma: no cover
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : encoding detection
+#=============================================================================
+"""encoding detection
+
+The detector scores a bounded sample against the byte grammars of mab2,
+mab2-xe0, marc and UTF-8:
+
+* ISO-5426 writes combining chars 0xc0 to 0xdf in front of a letter
+* MARC writes combining chars 0xe0 to 0xfe in front of a letter
+* mab2-xe0 is like mab2 but also accepts Latin-1 letters 0xe0 to 0xff,
+  which are undecodable in plain mab2
+* UTF-8 data has valid multi byte sequences
+* undecodable bytes count against an encoding
+* a MAB2 or MARC leader gives a hint (MARC leader/09 'a' is UTF-8)
+"""
+from __future__ import unicode_literals, print_function
+import re
+from smc.bibencodings.validate import get_validator
+
+ENCODINGS = ('mab2', 'mab2-xe0', 'marc', 'utf-8')
+SAMPLE_SIZE = 4096
+
+# tie breaker, the standard encoding wins
+_order = dict((name, -i * 0.001) for i, name in enumerate(ENCODINGS))
+
+_nonascii = re.compile(b'[\x80-\xff]')
+_iso_combining = re.compile(b'[\xc0-\xdf][A-Za-z]')
+_marc_combining = re.compile(b'[\xe0-\xfe][A-Za-z]')
+_utf8_sequence = re.compile(b'[\xc2-\xf4][\x80-\xbf]+')
+_mab_leader = re.compile(b'(?:### )?\\d{5}[a-z]M2\\.0')
+_marc_leader = re.compile(b'\\d{5}[a-z][a-z][ a-z][ a-z]([ a])\\d\\d\\d{5}')
+
+
+def _utf8_valid(sample):
+    try:
+        sample.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # sample may end in the middle of a sequence
+        return e.reason == "unexpected end of data"
+    return True
+
+
+def score(data, encodings=ENCODINGS):
+    """Score data, returns a dict that maps encoding names to scores
+
+    Scores are relative to the amount of non-ASCII bytes, negative scores
+    indicate undecodable data.
+    """
+    nonascii = len(_nonascii.findall(data))
+    scale = float(max(nonascii, 1))
+    iso = len(_iso_combining.findall(data))
+    hi = len(_marc_combining.findall(data))
+
+    # ISO-5426 has letters like 0xfb (sharp s) in the MARC combining range
+    support = {
+        'mab2': iso + 0.25 * hi,
+        'mab2-xe0': iso + 0.25 * hi,
+        'marc': hi,
+        }
+    result = {}
+    for name in encodings:
+        if name == 'utf-8':
+            if _utf8_valid(data):
+                value = 2 * len(_utf8_sequence.findall(data)) / scale
+            else:
+                value = -2.0
+        else:
+            invalid = len(data.translate(None, get_validator(name).valid))
+            value = (support[name] - 2 * invalid) / scale
+        result[name] = value + _order[name]
+
+    if _mab_leader.match(data):
+        hints = {'mab2': 0.3, 'mab2-xe0': 0.2}
+    else:
+        mo = _marc_leader.match(data)
+        if mo is None:
+            hints = {}
+        elif mo.group(1) == b'a':
+            hints = {'utf-8': 0.3}
+        else:
+            hints = {'marc': 0.3}
+    for name, hint in hints.items():
+        if name in result:
+            result[name] += hint
+    return result
+
+
+def detect(data, size=SAMPLE_SIZE):
+    """Detect the encoding of data from its first *size* bytes
+
+    Returns a list of (encoding, score) tuples, best guess first.
+    """
+    result = score(bytes(data[:size]))
+    return sorted(result.items(), key=lambda item: item[1], reverse=True)
+
+
+def _decodable(sample, name):
+    if name == 'utf-8':
+        return _utf8_valid(sample)
+    return not sample.translate(None, get_validator(name).valid)
+
+
+def guess(data, size=SAMPLE_SIZE):
+    """Return the name of the most likely encoding
+
+    Only encodings that decode the sample without errors are candidates,
+    returns None if there is no such encoding.
+    """
+    sample = bytes(data[:size])
+    for name, value in detect(sample, size):
+        if _decodable(sample, name):
+            return name
+    return None
+
+
+def guess_file(fileobj, size=SAMPLE_SIZE):
+    """Guess the encoding of a binary file object or file name, or None
+    """
+    if isinstance(fileobj, (bytes, type(""))):
+        with open(fileobj, "rb") as f:
+            return guess(f.read(size), size)
+    return guess(fileobj.read(size), size)
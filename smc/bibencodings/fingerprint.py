@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : record fingerprints
+#=============================================================================
+"""record fingerprints
+
+Fingerprints are BLAKE2 digests of the canonical byte form of a record and
+its fields (see canonical), so 0xc8 / 0xc9 variants hash equal and nothing
+has to be decoded. ChangeDetector compares a dump with the fingerprints of
+the previous run and only yields new and changed records::
+
+    detector = ChangeDetector("dump.mab.fp")
+    for change in detector.changes("dump.mab"):
+        index(change.record.decode("mab2"))
+    detector.save()
+
+Sidecar layout (little endian), one entry per record:
+  header: magic b"SMCFPRT1"
+  entry: key length (uint8), key, record digest (16 bytes), field count
+    (uint16), per field: tag (3 bytes) and digest (4 bytes)
+"""
+from __future__ import unicode_literals, print_function
+import os
+import struct
+from collections import namedtuple, Counter
+from hashlib import blake2b
+from smc.bibencodings.canonical import canonicalize
+from smc.bibencodings.index import control_number
+from smc.bibencodings.records import iter_mab2_fields, iter_marc_fields
+from smc.bibencodings.utils import iter_records, RECORD_TERMINATOR
+
+MAGIC = b"SMCFPRT1"
+DIGEST_SIZE = 16
+# field digests only tell which fields changed, the record digest decides
+FIELD_DIGEST_SIZE = 4
+
+_iter_fields = {
+    'mab2': iter_mab2_fields,
+    'marc': iter_marc_fields,
+    }
+
+Fingerprint = namedtuple("Fingerprint", "key digest fields")
+Change = namedtuple("Change", "key record status fields")
+
+
+def fingerprint(record, encoding='mab2', format='mab2', fields=True):
+    """Compute the fingerprint of a record
+
+    Returns Fingerprint(key, digest, fields), key is the control number or
+    the digest for records without field 001. fields is a tuple of
+    (tag, digest) or empty.
+    """
+    # repr keeps undecodable bytes distinguishable
+    canonical = canonicalize(record, encoding, 'repr')
+    digest = blake2b(canonical, digest_size=DIGEST_SIZE).digest()
+    # canonicalization can change the length of fields, the MARC directory
+    # only fits the original record
+    key = control_number(record, format)
+    if key is None:
+        key = digest
+    else:
+        key = canonicalize(key, encoding, 'repr')
+    field_digests = ()
+    if fields:
+        field_digests = tuple(
+            (tag, blake2b(tag + indicator +
+                          canonicalize(value, encoding, 'repr'),
+                          digest_size=FIELD_DIGEST_SIZE).digest())
+            for tag, indicator, value in _iter_fields[format](record))
+    return Fingerprint(key, digest, field_digests)
+
+
+def changed_tags(old, new):
+    """Return the sorted tags whose fields differ between two fingerprints
+    """
+    diff = Counter(old.fields)
+    diff.subtract(new.fields)
+    return sorted(set(tag for (tag, digest), count in diff.items() if count))
+
+
+def read_fingerprints(filename):
+    """Read a sidecar, returns a dict of key -> Fingerprint
+    """
+    result = {}
+    with open(filename, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("%s is not a fingerprint file" % filename)
+    pos = len(MAGIC)
+    fieldsize = 3 + FIELD_DIGEST_SIZE
+    try:
+        while pos < len(data):
+            keylen = data[pos]
+            pos += 1
+            key = data[pos:pos + keylen]
+            pos += keylen
+            digest = data[pos:pos + DIGEST_SIZE]
+            pos += DIGEST_SIZE
+            count, = struct.unpack_from("<H", data, pos)
+            pos += 2
+            fields = tuple((data[p:p + 3], data[p + 3:p + fieldsize])
+                           for p in range(pos, pos + count * fieldsize,
+                                          fieldsize))
+            pos += count * fieldsize
+            if pos > len(data):
+                raise ValueError
+            result[key] = Fingerprint(key, digest, fields)
+    except (IndexError, struct.error, ValueError):
+        raise ValueError("%s is truncated" % filename)
+    return result
+
+
+def write_fingerprints(filename, fingerprints):
+    """Write an iterable of Fingerprint objects to a sidecar
+
+    The file is replaced atomically.
+    """
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        for fp in fingerprints:
+            if len(fp.key) > 255 or len(fp.fields) > 65535:
+                raise ValueError("Fingerprint %r is too large" % fp.key)
+            parts = [bytes(bytearray([len(fp.key)])), fp.key, fp.digest,
+                     struct.pack("<H", len(fp.fields))]
+            for tag, digest in fp.fields:
+                parts.append(tag)
+                parts.append(digest)
+            f.write(b"".join(parts))
+    os.replace(tmp, filename)
+
+
+class ChangeDetector(object):
+    """Find new, changed and deleted records since the last run
+
+    sidecar is the fingerprint file of the previous run, it's read if it
+    exists. Call save() to store the fingerprints of this run.
+    """
+
+    def __init__(self, sidecar, encoding='mab2', format='mab2', fields=True):
+        if format not in _iter_fields:
+            raise ValueError("Unsupported format %s" % format)
+        self.sidecar = sidecar
+        self.encoding = encoding
+        self.format = format
+        self.fields = fields
+        if os.path.exists(sidecar):
+            self.previous = read_fingerprints(sidecar)
+        else:
+            self.previous = {}
+        self.current = {}
+        self.unchanged = 0
+
+    def check(self, record):
+        """Check one record, returns a Change or None if it's unchanged
+        """
+        fp = fingerprint(record, self.encoding, self.format, self.fields)
+        self.current[fp.key] = fp
+        old = self.previous.get(fp.key)
+        if old is None:
+            return Change(fp.key, record, "new",
+                          sorted(set(tag for tag, digest in fp.fields)))
+        if old.digest == fp.digest:
+            self.unchanged += 1
+            return None
+        return Change(fp.key, record, "changed", changed_tags(old, fp))
+
+    def changes(self, stream, terminator=RECORD_TERMINATOR, blocksize=65536):
+        """Yield a Change for every new or changed record of a stream
+
+        stream is a binary file or a file name.
+        """
+        check = self.check
+        for record in iter_records(stream, terminator, blocksize):
+            change = check(record)
+            if change is not None:
+                yield change
+
+    def deleted(self):
+        """Return the keys of records that weren't seen in this run
+        """
+        current = self.current
+        return sorted(key for key in self.previous if key not in current)
+
+    def save(self):
+        write_fingerprints(self.sidecar, self.current.values())
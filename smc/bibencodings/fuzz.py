@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : differential fuzzing
+#=============================================================================
+"""differential fuzzing
+
+compare() feeds random byte strings to a candidate decode function and to
+the reference decoder of the codec in all errors modes and reports every
+difference. The reference decoders are the original pure Python decode
+loops of iso5426 and marc, which work on charmap with DecodeIterator. The
+inputs are biased towards combining prefixes, the 0xc9 alias and valid
+table sequences including the special map of mab2-xe0, so double combined
+fallbacks and trailing combining bytes are hit often::
+
+    mismatches = compare(my_decode, "mab2", iterations=10000)
+
+A candidate is a callable (data, errors) -> text that raises UnicodeError
+for undecodable data in strict mode.
+
+``python -m smc.bibencodings.fuzz`` runs all built-in candidates (the
+decode function of the codec module, memoryview input, incremental
+decoding),
+``--throughput`` compares their speed on a large random input.
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import codecs
+import random
+import sys
+from collections import namedtuple
+from timeit import default_timer
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings.utils import DecodeIterator, bytechr
+
+ERRORS = ('strict', 'replace', 'ignore', 'repr')
+
+Mismatch = namedtuple("Mismatch", "data errors expected result")
+
+# codec module and special map of the codecs
+_codecs = {
+    'iso-5426': (iso5426, None),
+    'iso-5426-xe0': (iso5426, iso5426.special_xe0_map),
+    'marc': (marc, None),
+    }
+
+
+class InputGenerator(object):
+    """Deterministic random inputs for a codec
+    """
+
+    def __init__(self, encoding='mab2', seed=0):
+        name = codecs.lookup(encoding).name
+        module, special = _codecs[name]
+        self.random = random.Random(seed)
+        self.combining = bytes(bytearray(sorted(module._combining)))
+        self.sequences = sorted(set(module.charmap).union(special or ()))
+        # ASCII letters and punctuation that follow combining prefixes
+        self.ascii = b"aeiouAEOUcnsz .-"
+        self.bytes = bytes(bytearray(range(256)))
+
+    def piece(self):
+        rnd = self.random
+        choice = rnd.random()
+        if choice < 0.25:
+            return bytes(bytearray([rnd.choice(self.combining)]))
+        if choice < 0.35:
+            return b"\xc9"
+        if choice < 0.65:
+            return rnd.choice(self.sequences)
+        if choice < 0.85:
+            return bytes(bytearray([rnd.choice(self.ascii)]))
+        return bytes(bytearray([rnd.choice(self.bytes)]))
+
+    def __call__(self, maxsize=16):
+        """Return one input of up to maxsize pieces
+        """
+        size = self.random.randint(0, maxsize)
+        return b"".join(self.piece() for _ in range(size))
+
+
+def _run(func, data, errors):
+    try:
+        return func(data, errors)
+    except UnicodeError:
+        return UnicodeError
+
+
+def decode_iso5426(input, errors='strict', special=None):
+    """Reference decoder for ISO-5426, the original decode loop
+    """
+    if errors not in set(['strict', 'replace', 'ignore', 'repr']):
+        raise ValueError("Invalid errors argument %s" % errors)
+
+    result = []
+    di = DecodeIterator(input)
+    # optimizations
+    rappend = result.append
+    cget = iso5426.charmap.get
+    bchr = bytechr
+
+    for o in di:
+        # ASCII chars
+        if o < 0x7f:
+            rappend(chr(o))
+            continue
+
+        c = bchr[o]
+        o1, o2 = di.peek(2)
+        ccc2 = None
+        # 0xc0 to 0xdf signals a combined char
+        if 0xc0 <= o <= 0xdf and o1 is not None:
+            # special case 0xc9: both 0xc9 and 0xc9 are combining diaeresis
+            # use 0xc8 in favor of 0xc9
+            if o == 0xc9:
+                c = b'\xc8'
+            if o1 == 0xc9:
+                o1 = 0xc8
+            c1 = bchr[o1]
+            # double combined char
+            if 0xc0 <= o1 <= 0xdf and o2 is not None:
+                ccc2 = c + c1 + bchr[o2]
+                r = cget(ccc2)
+                if r is not None:
+                    # double combined found in table
+                    rappend(r)
+                    di.evolve(2)
+                    continue
+                # build combining unicode
+                dc1 = cget(c)
+                dc2 = cget(c1 + bchr[o2])
+                if dc1 is not None and dc2 is not None:
+                    # reverse order, in unicode, the combining char comes after the char
+                    rappend(dc2 + dc1)
+                    di.evolve(2)
+                    continue
+            else:
+                cc1 = c + c1
+                r = cget(cc1)
+                if r is not None:
+                    rappend(r)
+                    di.evolve(1)
+                    continue
+                # denormalized unicode: char + combining
+                r = cget(c)
+                rn = cget(c1)
+                if r is not None and rn is not None:
+                    rappend(rn + r)
+                    di.evolve(1)
+                    continue
+
+        # other chars, 0x80 <= o <= 0xbf or o >= 0xe0 or last combining
+        if special is not None:
+            r = special.get(c)
+            if r is not None:
+                rappend(r)
+                continue
+
+        r = cget(c)
+        if r is not None:
+            rappend(r)
+            continue
+
+        # only reached when no result was found
+        if errors == "strict":
+            p = di.position
+            raise UnicodeError("Can't decode byte%s %r at position %i (context %r)" %
+                               ("" if ccc2 is None else "s",
+                                c if ccc2 is None else ccc2,
+                                p, input[p - 3:p + 3]))
+        elif errors == "replace":
+            rappend('\ufffd')
+        elif errors == "ignore":
+            pass
+        elif errors == "repr":
+            rappend('\\x%x' % o)
+
+    return "".join(result), di.position
+
+
+def decode_marc(input, errors='strict'):
+    """Reference decoder for USMARC, the original decode loop
+    """
+    if errors not in set(['strict', 'replace', 'ignore', 'repr']):
+        raise ValueError("Invalid errors argument %s" % errors)
+
+    result = []
+    di = DecodeIterator(input)
+
+    # optimizations
+    combining = marc._combining
+    rappend = result.append
+    cget = marc.charmap.get
+    bchr = bytechr
+
+    for o in di:
+        # ASCII chars
+        if o <= 0x7f:
+            rappend(chr(o))
+            continue
+
+        c = bchr[o]
+        o1, o2 = di.peek(2)
+        cc = None
+        # 0xe0 to 0xff signals a combined char
+        if o in combining and o1 is not None:
+            # double combined char
+            if o1 in combining and o2 is not None:
+                cc = c + bchr[o1] + bchr[o2]
+                inc = 2
+            else:
+                cc = c + bchr[o1]
+                inc = 1
+            r = cget(cc)
+            if r is not None:
+                rappend(r)
+                di.evolve(inc)
+                continue
+
+        r = cget(c)
+        if r is not None:
+            rappend(r)
+            continue
+        # only reached when no result was found
+        if errors == "strict":
+            pos = di.position
+            raise UnicodeError("Can't decode byte%s %r at position %i (context %r)" %
+                               ("" if cc is None else "s",
+                                c if cc is None else cc,
+                                pos, input[pos - 3:pos + 3]))
+        elif errors == "replace":
+            rappend('\ufffd')
+        elif errors == "ignore":
+            pass
+        elif errors == "repr":
+            rappend('\\x%x' % o)
+
+    return "".join(result), di.position
+
+
+def reference(encoding):
+    """Return the reference decoder of a codec as (data, errors) -> text
+    """
+    module, special = _codecs[codecs.lookup(encoding).name]
+    if module is marc:
+        return lambda data, errors: decode_marc(bytes(data), errors)[0]
+    return lambda data, errors: decode_iso5426(bytes(data), errors,
+                                               special)[0]
+
+
+def compare(candidate, encoding='mab2', iterations=1000, maxsize=16, seed=0,
+            errors=ERRORS, maxmismatches=100):
+    """Compare a candidate decoder with the reference decoder
+
+    Returns a list of Mismatch tuples, expected and result are the decoded
+    text or UnicodeError.
+    """
+    ref = reference(encoding)
+    generate = InputGenerator(encoding, seed)
+    mismatches = []
+    for _ in range(iterations):
+        data = generate(maxsize)
+        for mode in errors:
+            expected = _run(ref, data, mode)
+            result = _run(candidate, data, mode)
+            if result != expected:
+                mismatches.append(Mismatch(data, mode, expected, result))
+                if len(mismatches) >= maxmismatches:
+                    return mismatches
+    return mismatches
+
+
+def _decode_candidate(encoding):
+    module, special = _codecs[codecs.lookup(encoding).name]
+    if module is marc:
+        return lambda data, errors: marc.decode(data, errors)[0]
+    return lambda data, errors: iso5426.decode(data, errors, special)[0]
+
+
+def _buffer_candidate(encoding):
+    decode = codecs.lookup(encoding).decode
+    return lambda data, errors: decode(memoryview(bytearray(data)), errors)[0]
+
+
+def _incremental_candidate(encoding):
+    factory = codecs.getincrementaldecoder(encoding)
+
+    def decode(data, errors):
+        # chunks of 1, 2 and 3 bytes split combining sequences
+        decoder = factory(errors)
+        result = []
+        pos = size = 0
+        while pos < len(data):
+            size = size % 3 + 1
+            result.append(decoder.decode(data[pos:pos + size]))
+            pos += size
+        result.append(decoder.decode(b"", True))
+        return "".join(result)
+    return decode
+
+
+# built-in candidates, name -> factory(encoding)
+CANDIDATES = {
+    'decode': _decode_candidate,
+    'buffer': _buffer_candidate,
+    'incremental': _incremental_candidate,
+    }
+
+
+def throughput(candidates, encoding='mab2', size=1 << 20, seed=0,
+               errors='replace'):
+    """Measure decode speed on one large random input
+
+    candidates is a dict of name -> decode function. Returns a list of
+    (name, MB/s), the reference decoder is included.
+    """
+    generate = InputGenerator(encoding, seed)
+    chunks = []
+    length = 0
+    while length < size:
+        chunk = generate(64)
+        chunks.append(chunk)
+        length += len(chunk)
+    data = b"".join(chunks)
+    funcs = [("reference", reference(encoding))]
+    funcs.extend(sorted(candidates.items()))
+    results = []
+    for name, func in funcs:
+        start = default_timer()
+        func(data, errors)
+        elapsed = default_timer() - start
+        results.append((name, len(data) / elapsed / 1e6))
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m smc.bibencodings.fuzz",
+        description="compare decoders with the reference decoder")
+    parser.add_argument("--encoding", action="append",
+                        help="codec name (default: mab2, mab2-xe0, marc)")
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--maxsize", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--throughput", action="store_true",
+                        help="measure speed instead of comparing output")
+    options = parser.parse_args(args)
+    failed = 0
+    for encoding in options.encoding or ("mab2", "mab2-xe0", "marc"):
+        candidates = dict((name, factory(encoding))
+                          for name, factory in CANDIDATES.items())
+        if options.throughput:
+            for name, speed in throughput(candidates, encoding,
+                                          seed=options.seed):
+                print("%-10s %-12s %6.1f MB/s" % (encoding, name, speed))
+            continue
+        for name, candidate in sorted(candidates.items()):
+            mismatches = compare(candidate, encoding, options.iterations,
+                                 options.maxsize, options.seed)
+            print("%-10s %-12s %i mismatches" % (encoding, name,
+                                                 len(mismatches)))
+            for mismatch in mismatches[:5]:
+                print("  %r" % (mismatch,))
+            failed += len(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__": # pragma: no cover
+    sys.exit(main())
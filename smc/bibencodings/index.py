@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : record index
+#=============================================================================
+"""record index
+
+A sidecar index maps the control number (field 001) of each record in a
+MAB2 or MARC dump to the offset and length of the record. The index file
+is a header followed by fixed size entries sorted by control number, it's
+searched in place with mmap::
+
+    build_index("dump.mab")
+    with RecordIndex("dump.mab") as index:
+        text = index.decode("HT016189653")
+
+build_index() sorts at most sortsize entries in memory, larger dumps are
+sorted in runs in temporary files that are merged. Records that can't be
+indexed (malformed MARC directory, control number longer than keysize) are
+skipped.
+
+File layout (little endian):
+  header: magic b"SMCRIDX1", keysize (uint32), count (uint64)
+  entry: control number (keysize bytes, padded with NUL), offset (uint64),
+    length (uint32)
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+import heapq
+import mmap
+import struct
+import tempfile
+from collections import namedtuple
+from smc.bibencodings.records import iter_mab2_fields, iter_marc_fields
+from smc.bibencodings.utils import iter_records, RECORD_TERMINATOR
+
+MAGIC = b"SMCRIDX1"
+HEADER = struct.Struct("<8sIQ")
+ENTRY = "<%isQI"
+KEYSIZE = 32
+# entries sorted in memory, about 200 bytes each
+SORTSIZE = 1 << 18
+
+SkippedRecord = namedtuple("SkippedRecord", "index offset length error")
+
+_iter_fields = {
+    'mab2': iter_mab2_fields,
+    'marc': iter_marc_fields,
+    }
+
+
+def control_number(record, format='mab2'):
+    """Return the value of field 001 as bytes or None
+    """
+    for tag, indicator, value in _iter_fields[format](record, (b"001",)):
+        return value
+    return None
+
+
+def _key(key, keysize):
+    if not isinstance(key, bytes):
+        key = key.encode("ascii")
+    if len(key) > keysize:
+        raise ValueError("Control number %r is longer than %i bytes" %
+                         (key, keysize))
+    return key.ljust(keysize, b"\0")
+
+
+def _write_run(entries, entry):
+    """Sort entries and write them to a temporary file
+    """
+    entries.sort()
+    run = tempfile.TemporaryFile()
+    pack = entry.pack
+    run.writelines(pack(*e) for e in entries)
+    run.seek(0)
+    return run
+
+
+def _read_run(run, entry, blocksize=65536):
+    size = entry.size * max(blocksize // entry.size, 1)
+    while True:
+        data = run.read(size)
+        if not data:
+            break
+        for e in entry.iter_unpack(data):
+            yield e
+
+
+def build_index(datafile, indexfile=None, format='mab2', keysize=KEYSIZE,
+                terminator=RECORD_TERMINATOR, blocksize=65536,
+                sortsize=SORTSIZE, skipped=None):
+    """Build the index of a dump, returns the number of indexed records
+
+    Records without field 001 are not indexed. The index file defaults to
+    datafile + ".idx". Records that can't be indexed are skipped, pass a
+    list as skipped to collect a SkippedRecord for each of them.
+    """
+    if format not in _iter_fields:
+        raise ValueError("Unsupported format %s" % format)
+    if indexfile is None:
+        indexfile = datafile + ".idx"
+    entry = struct.Struct(ENTRY % keysize)
+    entries = []
+    runs = []
+    count = 0
+    offset = 0
+    try:
+        with open(datafile, "rb") as f:
+            records = iter_records(f, terminator, blocksize)
+            for index, record in enumerate(records):
+                try:
+                    key = control_number(record, format)
+                    if key is not None:
+                        key = _key(key, keysize)
+                except ValueError as e:
+                    if skipped is not None:
+                        skipped.append(SkippedRecord(index, offset,
+                                                     len(record), str(e)))
+                else:
+                    if key is not None:
+                        entries.append((key, offset, len(record)))
+                        count += 1
+                        if len(entries) >= sortsize:
+                            runs.append(_write_run(entries, entry))
+                            entries = []
+                offset += len(record)
+        if runs:
+            if entries:
+                runs.append(_write_run(entries, entry))
+            entries = heapq.merge(*[_read_run(run, entry, blocksize)
+                                    for run in runs])
+        else:
+            entries.sort()
+        with open(indexfile, "wb") as f:
+            f.write(HEADER.pack(MAGIC, keysize, count))
+            pack = entry.pack
+            f.writelines(pack(*e) for e in entries)
+    finally:
+        for run in runs:
+            run.close()
+    return count
+
+
+class RecordIndex(object):
+    """Look up records of a dump by control number
+
+    Lookups are a binary search on the memory mapped index file.
+    """
+
+    def __init__(self, datafile, indexfile=None, encoding='mab2',
+                 errors='strict'):
+        if indexfile is None:
+            indexfile = datafile + ".idx"
+        self.decoder = codecs.getdecoder(encoding)
+        self.errors = errors
+        with open(indexfile, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                raise ValueError("%s is not a record index" % indexfile)
+            magic, self.keysize, self.count = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("%s is not a record index" % indexfile)
+            self._entry = struct.Struct(ENTRY % self.keysize)
+            expected = HEADER.size + self.count * self._entry.size
+            f.seek(0, 2)
+            if f.tell() != expected:
+                raise ValueError("%s is truncated" % indexfile)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = open(datafile, "rb")
+
+    def __len__(self):
+        return self.count
+
+    def _search(self, key):
+        """Return the entry index of key or -1
+        """
+        key = _key(key, self.keysize)
+        mm = self._mmap
+        keysize = self.keysize
+        size = self._entry.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = HEADER.size + mid * size
+            if mm[pos:pos + keysize] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            pos = HEADER.size + lo * size
+            if mm[pos:pos + keysize] == key:
+                return lo
+        return -1
+
+    def find(self, key):
+        """Return (offset, length) of the record or None
+        """
+        i = self._search(key)
+        if i == -1:
+            return None
+        pos = HEADER.size + i * self._entry.size
+        return self._entry.unpack_from(self._mmap, pos)[1:]
+
+    def __contains__(self, key):
+        return self._search(key) != -1
+
+    def get(self, key):
+        """Return the raw record as bytes, raises KeyError
+        """
+        location = self.find(key)
+        if location is None:
+            raise KeyError(key)
+        offset, length = location
+        self._data.seek(offset)
+        return self._data.read(length)
+
+    def decode(self, key):
+        """Return the decoded record, raises KeyError
+        """
+        return self.decoder(self.get(key), self.errors)[0]
+
+    def keys(self):
+        """Iterate over the control numbers in sorted order
+        """
+        mm = self._mmap
+        size = self._entry.size
+        for i in range(self.count):
+            pos = HEADER.size + i * size
+            yield mm[pos:pos + self.keysize].rstrip(b"\0")
+
+    def close(self):
+        self._mmap.close()
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
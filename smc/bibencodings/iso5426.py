@@ -13,20 +13,62 @@
 """
 from __future__ import unicode_literals, print_function
 import codecs
-from smc.bibencodings.utils import DecodeIterator
+import re
+from timeit import default_timer
+from smc.bibencodings.utils import CharTables, EncodeTables, byteview
+from smc.bibencodings.utils import combining_tail, BufferedIncrementalEncoder
+
+# combining 0xc0 to 0xdf
+_combining = set(range(0xc0, 0xe0))
+# 0x00 to 0x7e are decoded as ASCII
+_nonascii = re.compile(b'[\x7f-\xff]')
+_decode_errors = frozenset(['strict', 'replace', 'ignore', 'repr'])
+_encode_errors = frozenset(['strict', 'replace', 'ignore'])
+
+# instrumentation, see smc.bibencodings.stats
+_stats = None
 
 
 def encode(input, errors='strict'):
     """Encode unicode as ISO-5426
     """
-    if errors not in set(['strict', 'replace', 'ignore']):
+    buffer = bytearray()
+    encode_into(input, buffer, errors)
+    return bytes(buffer), len(input)
+
+
+def encode_into(input, buffer, errors='strict', tables=None):
+    """Encode unicode as ISO-5426 and append it to a bytearray
+
+    Returns (bytes written, chars consumed). tables are the EncodeTables of
+    a unicodemap.
+    """
+    if errors not in _encode_errors:
         raise ValueError("Invalid errors argument %s" % errors)
-    result = []
-    rappend = result.append
-    uget = unicodemap.get
+    if tables is None:
+        tables = _lazy('_encode_tables')
+    stats = _stats
+    if stats is not None:
+        start = default_timer()
+    begin = len(buffer)
+    try:
+        # fast path, every char has a fixed byte sequence
+        buffer += input.translate(tables.translate).encode("latin-1")
+    except UnicodeEncodeError:
+        pass
+    else:
+        if stats is not None:
+            stats.add_encode(len(input), default_timer() - start)
+        return len(buffer) - begin, len(input)
+    # start of the last char, combining chars are moved in front of it
+    last = None
+    uget = tables.unicodemap.get
+    reorder = tables.reorder
     for u in input:
         s = uget(u)
         if s is None:
+            if stats is not None:
+                stats.encode_errors += 1
             if errors == 'strict':
                 raise UnicodeError(repr(u))
             elif errors == "replace":
@@ -37,111 +79,293 @@ def encode(input, errors='strict'):
                 # should never be reached
                 raise ValueError("Invalid errors argument %s" % errors)
         # special case combining char, move it in front of the last char
-        if len(s) == 1 and 0xc0 <= ord(s) <= 0xdf:
-            result.insert(-1, s)
-        else:
-            rappend(s)
-    return b"".join(result), len(input)
+        elif u in reorder and last is not None:
+            buffer[last:last] = s
+            last += 1
+            if stats is not None:
+                stats.reordered += 1
+            continue
+        last = len(buffer)
+        buffer += s
+    if stats is not None:
+        stats.add_encode(len(input), default_timer() - start)
+    return len(buffer) - begin, len(input)
 
 
-def decode(input, errors='strict', special=None):
+def decode(input, errors='strict', special=None, tables=None):
     """Decode unicode from ISO-5426
+
+    input can be any object with buffer interface. tables are the compiled
+    CharTables of charmap and special.
     """
-    if errors not in set(['strict', 'replace', 'ignore', 'repr']):
+    if errors not in _decode_errors:
         raise ValueError("Invalid errors argument %s" % errors)
+    if tables is None:
+        if special is None:
+            tables = _lazy('_tables')
+        elif special is special_xe0_map:
+            tables = _lazy('_xe0_tables')
+        else:
+            tables = CharTables(_lazy('charmap'), special)
 
+    stats = _stats
+    if stats is not None:
+        start = default_timer()
+        # bytes consumed by non-ASCII chars
+        nonascii = 0
+    data = byteview(input)
+    length = len(data)
     result = []
-    di = DecodeIterator(input)
     # optimizations
     rappend = result.append
-    cget = charmap.get
+    search = _nonascii.search
+    single = tables.single
+    fallback = tables.fallback
+    dget = tables.double.get
+    tget = tables.triple.get
 
-    for c in di:
-        o = ord(c)
+    pos = 0
+    while pos < length:
         # ASCII chars
-        if c < b'\x7f':
-            rappend(chr(o))
-            #i += 1
-            continue
+        mo = search(data, pos)
+        if mo is None:
+            rappend(str(data[pos:], 'latin-1'))
+            pos = length
+            break
+        nextpos = mo.start()
+        if nextpos != pos:
+            rappend(str(data[pos:nextpos], 'latin-1'))
+            pos = nextpos
 
-        c1, c2 = di.peek(2)
-        ccc2 = None
+        o = c = data[pos]
+        size = 1
         # 0xc0 to 0xdf signals a combined char
-        if 0xc0 <= o <= 0xdf and c1 is not None:
+        if 0xc0 <= o <= 0xdf and pos + 1 < length:
+            o1 = data[pos + 1]
             # special case 0xc9: both 0xc9 and 0xc9 are combining diaeresis
             # use 0xc8 in favor of 0xc9
-            if c == b'\xc9':
-                c = b'\xc8'
-            if c1 == b'\xc9':
-                c1 = b'\xc8'
+            if o == 0xc9:
+                c = 0xc8
+            if o1 == 0xc9:
+                o1 = 0xc8
             # double combined char
-            if 0xc0 <= ord(c1) <= 0xdf and c2 is not None:
-                ccc2 = c + c1 + c2
-                r = cget(ccc2)
+            if 0xc0 <= o1 <= 0xdf and pos + 2 < length:
+                size = 3
+                o2 = data[pos + 2]
+                r = tget((c << 16) | (o1 << 8) | o2)
                 if r is not None:
                     # double combined found in table
                     rappend(r)
-                    di.evolve(2)
+                    pos += 3
+                    if stats is not None:
+                        stats.double += 1
+                        stats.sequences[data[pos - 3:pos].tobytes()] += 1
+                        nonascii += 3
                     continue
                 # build combining unicode
-                dc1 = cget(c)
-                dc2 = cget(c1 + c2)
+                dc1 = single[c]
+                dc2 = dget((o1 << 8) | o2)
                 if dc1 is not None and dc2 is not None: # pragma: no branch
                     # reverse order, in unicode, the combining char comes after the char
                     rappend(dc2 + dc1)
-                    di.evolve(2)
+                    pos += 3
+                    if stats is not None:
+                        stats.decomposed += 1
+                        stats.sequences[data[pos - 3:pos].tobytes()] += 1
+                        nonascii += 3
                     continue
             else:
-                cc1 = c + c1
-                r = cget(cc1)
+                r = dget((c << 8) | o1)
                 if r is not None:
                     rappend(r)
-                    di.evolve(1)
+                    pos += 2
+                    if stats is not None:
+                        stats.combined += 1
+                        stats.sequences[data[pos - 2:pos].tobytes()] += 1
+                        nonascii += 2
                     continue
                 # denormalized unicode: char + combining
-                r = cget(c)
-                rn = cget(c1)
+                r = single[c]
+                rn = single[o1]
                 if r is not None and rn is not None: # pragma: no branch
                     rappend(rn + r)
-                    di.evolve(1)
+                    pos += 2
+                    if stats is not None:
+                        stats.denormalized += 1
+                        stats.sequences[data[pos - 2:pos].tobytes()] += 1
+                        nonascii += 2
                     continue
 
-            # just the combining
-            #r = cget(c)
-            #if r is not None:
-            #    result.append(r)
-            #    continue
-
         # other chars, 0x80 <= o <= 0xbf or o >= 0xe0 or last combining
-        if special is not None:
-            r = special.get(c)
+        r = fallback[c]
+        if r is not None:
+            rappend(r)
+            pos += 1
+            if stats is not None:
+                if tables.special[c] is not None:
+                    stats.special += 1
+                else:
+                    stats.single += 1
+                stats.sequences[data[pos - 1:pos].tobytes()] += 1
+                nonascii += 1
+            continue
+
+        if stats is not None:
+            stats.errors += 1
+            stats.unmapped[o] += 1
+            nonascii += 1
+
+        # only reached when no result was found
+        if errors == "strict":
+            if stats is not None:
+                # the failed call is counted up to the undecodable byte
+                stats.add_decode(pos + 1, pos + 1 - nonascii,
+                                 default_timer() - start)
+            raise UnicodeError("Can't decode byte%s %r at position %i (context %r)" %
+                               ("" if size == 1 else "s",
+                                data[pos:pos + size].tobytes(),
+                                pos, data[max(pos - 3, 0):pos + 3].tobytes()))
+        elif errors == "replace":
+            rappend('\ufffd')
+        elif errors == "ignore":
+            pass
+        elif errors == "repr":
+            rappend('\\x%x' % o)
+        else: # pragma: no cover
+            # should never be reached
+            raise ValueError("Invalid errors argument %s" % errors)
+        pos += 1
+
+    if stats is not None:
+        stats.add_decode(pos, pos - nonascii, default_timer() - start)
+    return "".join(result), pos
+
+
+def transcode_tables(convert, special=None):
+    """Compile CharTables that map ISO-5426 sequences to bytes
+
+    convert is called with the decoded text of every sequence the decoder
+    knows, including char + combining char and double combined chars that
+    are built from their parts. A sequence is copied if convert returns
+    None. transcode() with these tables never creates text.
+    """
+    tables = _lazy('_tables')
+    single = tables.single
+    double = tables.double
+    sequences = dict(_lazy('charmap'))
+    for c in _combining:
+        if c == 0xc9 or single[c] is None:
+            # 0xc9 is replaced by 0xc8 before the lookup
+            continue
+        # denormalized unicode: char + combining
+        for o1 in range(256):
+            key = bytes(bytearray([c, o1]))
+            if key not in sequences and single[o1] is not None:
+                sequences[key] = single[o1] + single[c]
+        # double combined char from combining char and combined char
+        for key, value in list(double.items()):
+            key = bytes(bytearray([c, key >> 8, key & 0xff]))
+            if key[1] in _combining and key not in sequences:
+                sequences[key] = value + single[c]
+    converted = {}
+    for key, value in sequences.items():
+        value = convert(value)
+        converted[key] = key if value is None else value
+    if special is not None:
+        special = dict((key, key if convert(value) is None else convert(value))
+                       for key, value in special.items())
+    return CharTables(converted, special)
+
+
+def transcode(input, tables, errors='strict', replacement=b'?',
+              lookahead=False):
+    """Transcode ISO-5426 to bytes with tables from transcode_tables()
+
+    The input is parsed like decode() does, ASCII runs are copied. Returns
+    (bytes, consumed).
+
+    The decoder looks at the next two bytes before it decodes a combining
+    char on its own. With lookahead=True these bytes are copied, so the
+    result of an ISO-5426 to ISO-5426 transcoding is split into the same
+    chars by the decoder.
+    """
+    if errors not in _decode_errors:
+        raise ValueError("Invalid errors argument %s" % errors)
+    data = byteview(input)
+    length = len(data)
+    result = []
+    # optimizations
+    rappend = result.append
+    search = _nonascii.search
+    fallback = tables.fallback
+    dget = tables.double.get
+    tget = tables.triple.get
+    # bytes before this position are copied
+    copy = 0
+
+    pos = 0
+    while pos < length:
+        # ASCII chars
+        mo = search(data, pos)
+        if mo is None:
+            rappend(data[pos:].tobytes())
+            pos = length
+            break
+        nextpos = mo.start()
+        if nextpos != pos:
+            rappend(data[pos:nextpos].tobytes())
+            pos = nextpos
+
+        o = c = data[pos]
+        size = 1
+        combined = 0xc0 <= o <= 0xdf and pos + 1 < length
+        if combined:
+            o1 = data[pos + 1]
+            if o == 0xc9:
+                c = 0xc8
+            if o1 == 0xc9:
+                o1 = 0xc8
+            if 0xc0 <= o1 <= 0xdf and pos + 2 < length:
+                size = 3
+                r = tget((c << 16) | (o1 << 8) | data[pos + 2])
+            else:
+                r = dget((c << 8) | o1)
             if r is not None:
+                end = pos + (3 if size == 3 else 2)
+                if pos < copy:
+                    r = data[pos:end].tobytes()
                 rappend(r)
+                pos = end
                 continue
 
-        r = cget(c)
+        r = fallback[c]
         if r is not None:
+            if pos < copy:
+                r = data[pos:pos + 1].tobytes()
+            if combined and lookahead:
+                # combining char without partner
+                copy = pos + 3
             rappend(r)
+            pos += 1
             continue
 
-        # only reached when no result was found
         if errors == "strict":
-            p = di.position
             raise UnicodeError("Can't decode byte%s %r at position %i (context %r)" %
-                               ("" if ccc2 is None else "s",
-                                c if ccc2 is None else ccc2,
-                                p, input[p - 3:p + 3]))
+                               ("" if size == 1 else "s",
+                                data[pos:pos + size].tobytes(),
+                                pos, data[max(pos - 3, 0):pos + 3].tobytes()))
         elif errors == "replace":
-            rappend('\ufffd')
+            rappend(replacement)
         elif errors == "ignore":
             pass
         elif errors == "repr":
-            rappend('\\x%x' % o)
+            rappend(b'\\x%x' % o)
         else: # pragma: no cover
             # should never be reached
             raise ValueError("Invalid errors argument %s" % errors)
+        pos += 1
 
-    return "".join(result), di.position
+    return b"".join(result), pos
 
 
 ### Codec APIs
@@ -153,6 +377,24 @@ class Codec(codecs.Codec):
         return decode(input, errors)
 
 
+class IncrementalDecoder(codecs.BufferedIncrementalDecoder):
+
+    def _buffer_decode(self, input, errors, final):
+        if not final:
+            # keep trailing combining chars until their base char arrives
+            input = input[:len(input) - combining_tail(input, _combining)]
+        return decode(input, errors)
+
+
+class IncrementalEncoder(BufferedIncrementalEncoder):
+
+    def _tables(self):
+        return _lazy('_text_encode_tables')
+
+    def _encode_into(self, input, buffer, errors, tables):
+        return encode_into(input, buffer, errors, tables)
+
+
 class StreamWriter(Codec, codecs.StreamWriter):
     pass
 
@@ -166,6 +408,8 @@ codecInfo = codecs.CodecInfo(
     name='iso-5426',
     encode=Codec().encode,
     decode=Codec().decode,
+    incrementalencoder=IncrementalEncoder,
+    incrementaldecoder=IncrementalDecoder,
     streamreader=StreamReader,
     streamwriter=StreamWriter)
 
@@ -180,6 +424,14 @@ class SpecialXE0Codec(codecs.Codec):
         return decode(input, errors, special_xe0_map)
 
 
+class SpecialXE0IncrementalDecoder(codecs.BufferedIncrementalDecoder):
+
+    def _buffer_decode(self, input, errors, final):
+        if not final:
+            input = input[:len(input) - combining_tail(input, _combining)]
+        return decode(input, errors, special_xe0_map)
+
+
 class SpecialXE0StreamWriter(SpecialXE0Codec, codecs.StreamWriter):
     pass
 
@@ -193,6 +445,8 @@ specialXE0CodecInfo = codecs.CodecInfo(
     name='iso-5426-xe0',
     encode=SpecialXE0Codec().encode,
     decode=SpecialXE0Codec().decode,
+    incrementalencoder=IncrementalEncoder,
+    incrementaldecoder=SpecialXE0IncrementalDecoder,
     streamreader=SpecialXE0StreamReader,
     streamwriter=SpecialXE0StreamWriter)
 
@@ -869,8 +1123,43 @@ unicodemap = {
     '\ufe23': b'\xdf', # COMBINING DOUBLE TILDE RIGHT HALF
 }
 
-charmap = {}
-for uni, char in getattr(unicodemap, "iteritems", unicodemap.items)():
-    if char in charmap:
-        continue
-    charmap[char] = uni
+def _build_charmap():
+    charmap = {}
+    for uni, char in unicodemap.items():
+        if char in charmap:
+            continue
+        charmap[char] = uni
+    return charmap
+
+
+# charmap and the compiled tables are built on first use, workers that
+# decode with shared tables (see sharedtables) never build them
+_builders = {
+    'charmap': _build_charmap,
+    # chars that are encoded as a single combining byte
+    '_reorder': lambda: frozenset(uni for uni, char in unicodemap.items()
+                                  if len(char) == 1 and ord(char) in _combining),
+    '_encode_tables': lambda: EncodeTables(unicodemap, _lazy('_reorder')),
+    # text files also need line breaks, see IncrementalEncoder
+    '_text_encode_tables': lambda: EncodeTables(
+        dict(unicodemap, **{"\n": b"\n", "\r": b"\r"}), _lazy('_reorder')),
+    '_tables': lambda: CharTables(_lazy('charmap')),
+    '_xe0_tables': lambda: CharTables(_lazy('charmap'), special_xe0_map),
+    }
+
+
+def _lazy(name):
+    """Return charmap or a compiled table, build it on first use
+    """
+    tables = globals()
+    try:
+        return tables[name]
+    except KeyError:
+        value = tables[name] = _builders[name]()
+        return value
+
+
+def __getattr__(name):
+    if name in _builders:
+        return _lazy(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
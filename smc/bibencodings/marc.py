@@ -13,25 +13,62 @@
 """
 from __future__ import unicode_literals, print_function
 import codecs
-from smc.bibencodings.utils import DecodeIterator
+import re
+from timeit import default_timer
+from smc.bibencodings.utils import CharTables, EncodeTables, byteview
+from smc.bibencodings.utils import combining_tail, BufferedIncrementalEncoder
 
 # combining 0xe0 to 0xfe except 0xec, 0xfb, 0xfc, 0xfd
 _combining = set([224, 225, 226, 227, 228, 229, 230, 231, 232, 233, 234, 235,
                   237, 238, 239, 240, 241, 242, 243, 244, 245, 246, 247, 248,
                   249, 250, 254])
 
+# 0x00 to 0x7f are decoded as ASCII
+_nonascii = re.compile(b'[\x80-\xff]')
+_decode_errors = frozenset(['strict', 'replace', 'ignore', 'repr'])
+_encode_errors = frozenset(['strict', 'replace', 'ignore'])
+
+# instrumentation, see smc.bibencodings.stats
+_stats = None
+
 
 def encode(input, errors='strict'):
     """Encode unicode as USMARC
     """
-    if errors not in set(['strict', 'replace', 'ignore']):
+    buffer = bytearray()
+    encode_into(input, buffer, errors)
+    return bytes(buffer), len(input)
+
+
+def encode_into(input, buffer, errors='strict', tables=None):
+    """Encode unicode as USMARC and append it to a bytearray
+
+    Returns (bytes written, chars consumed). tables are the EncodeTables of
+    a unicodemap.
+    """
+    if errors not in _encode_errors:
         raise ValueError("Invalid errors argument %s" % errors)
-    result = []
-    rappend = result.append
-    uget = unicodemap.get
+    if tables is None:
+        tables = _lazy('_encode_tables')
+    stats = _stats
+    if stats is not None:
+        start = default_timer()
+    begin = len(buffer)
+    try:
+        # fast path, every char has a fixed byte sequence
+        buffer += input.translate(tables.translate).encode("latin-1")
+    except UnicodeEncodeError:
+        pass
+    else:
+        if stats is not None:
+            stats.add_encode(len(input), default_timer() - start)
+        return len(buffer) - begin, len(input)
+    uget = tables.unicodemap.get
     for u in input:
         s = uget(u)
         if s is None:
+            if stats is not None:
+                stats.encode_errors += 1
             if errors == 'strict':
                 raise UnicodeError(repr(u))
             elif errors == "replace":
@@ -41,75 +78,102 @@ def encode(input, errors='strict'):
             else: # pragma: no cover
                 # should never be reached
                 raise ValueError("Invalid errors argument %s" % errors)
-        rappend(s)
-    return b"".join(result), len(input)
+        buffer += s
+    if stats is not None:
+        stats.add_encode(len(input), default_timer() - start)
+    return len(buffer) - begin, len(input)
 
 
-def decode(input, errors='strict', special=None):
+def decode(input, errors='strict', special=None, tables=None):
     """Decode unicode from USMARC
+
+    input can be any object with buffer interface. tables are the compiled
+    CharTables of charmap.
     """
-    if errors not in set(['strict', 'replace', 'ignore', 'repr']):
+    if errors not in _decode_errors:
         raise ValueError("Invalid errors argument %s" % errors)
+    if tables is None:
+        tables = _lazy('_tables')
 
+    stats = _stats
+    if stats is not None:
+        start = default_timer()
+        # bytes consumed by non-ASCII chars
+        nonascii = 0
+    data = byteview(input)
+    length = len(data)
     result = []
-    di = DecodeIterator(input)
-
     # optimizations
     combining = _combining
     rappend = result.append
-    cget = charmap.get
+    search = _nonascii.search
+    fallback = tables.fallback
+    dget = tables.double.get
+    tget = tables.triple.get
 
-    for c in di:
-        o = ord(c)
+    pos = 0
+    while pos < length:
         # ASCII chars
-        if c <= b'\x7f':
-            rappend(chr(o))
-            continue
+        mo = search(data, pos)
+        if mo is None:
+            rappend(str(data[pos:], 'latin-1'))
+            pos = length
+            break
+        nextpos = mo.start()
+        if nextpos != pos:
+            rappend(str(data[pos:nextpos], 'latin-1'))
+            pos = nextpos
 
-        c1, c2 = di.peek(2)
-        cc = None
+        o = data[pos]
+        size = 1
         # 0xe0 to 0xff signals a combined char
-        if o in combining and c1 is not None:
+        if o in combining and pos + 1 < length:
+            o1 = data[pos + 1]
             # double combined char
-            if ord(c1) in combining and c2 is not None:
-                cc = c + c1 + c2
-                inc = 2
+            if o1 in combining and pos + 2 < length:
+                size = 3
+                r = tget((o << 16) | (o1 << 8) | data[pos + 2])
             else:
-                cc = c + c1
-                inc = 1
-            r = cget(cc)
+                size = 2
+                r = dget((o << 8) | o1)
             if r is not None:
                 rappend(r)
-                di.evolve(inc)
+                pos += size
+                if stats is not None:
+                    if size == 3:
+                        stats.double += 1
+                    else:
+                        stats.combined += 1
+                    stats.sequences[data[pos - size:pos].tobytes()] += 1
+                    nonascii += size
                 continue
-            # just the combining
-            #r = cget(c)
-            #if r is not None:
-            #    rappend(r)
-            #    i += 1
-            #    continue
 
         # other chars
-        #if special is not None:
-        #    r = special.get(c)
-        #    if r is not None:
-        #        rappend(r)
-        #        i += 1
-        #        continue
-
-        r = cget(c)
+        r = fallback[o]
         if r is not None:
             rappend(r)
+            pos += 1
+            if stats is not None:
+                stats.single += 1
+                stats.sequences[data[pos - 1:pos].tobytes()] += 1
+                nonascii += 1
             continue
+        if stats is not None:
+            stats.errors += 1
+            stats.unmapped[o] += 1
+            nonascii += 1
         # only reached when no result was found
         if errors == "strict":
-            pos = di.position
+            if stats is not None:
+                # the failed call is counted up to the undecodable byte
+                stats.add_decode(pos + 1, pos + 1 - nonascii,
+                                 default_timer() - start)
             raise UnicodeError("Can't decode byte%s %r at position %i (context %r)" %
-                               ("" if cc is None else "s",
-                                c if cc is None else cc,
-                                pos, input[pos - 3:pos + 3]))
+                               ("" if size == 1 else "s",
+                                data[pos:pos + size].tobytes(),
+                                pos, data[max(pos - 3, 0):pos + 3].tobytes()))
         elif errors == "replace":
-            result.append('\ufffd')
+            rappend('\ufffd')
         elif errors == "ignore":
             pass
         elif errors == "repr":
@@ -117,8 +181,95 @@ def decode(input, errors='strict', special=None):
         else: # pragma: no cover
             # should never be reached
             raise ValueError("Invalid errors argument %s" % errors)
+        pos += 1
+
+    if stats is not None:
+        stats.add_decode(pos, pos - nonascii, default_timer() - start)
+    return "".join(result), pos
+
+
+def transcode_tables(convert):
+    """Compile CharTables that map USMARC sequences to bytes
+
+    convert is called with the decoded text of every sequence in charmap.
+    A sequence is copied if convert returns None.
+    """
+    converted = {}
+    for key, value in _lazy('charmap').items():
+        value = convert(value)
+        converted[key] = key if value is None else value
+    return CharTables(converted)
 
-    return "".join(result), di.position
+
+def transcode(input, tables, errors='strict', replacement=b'?'):
+    """Transcode USMARC to bytes with tables from transcode_tables()
+
+    The input is parsed like decode() does, ASCII runs are copied. Returns
+    (bytes, consumed).
+    """
+    if errors not in _decode_errors:
+        raise ValueError("Invalid errors argument %s" % errors)
+    data = byteview(input)
+    length = len(data)
+    result = []
+    # optimizations
+    combining = _combining
+    rappend = result.append
+    search = _nonascii.search
+    fallback = tables.fallback
+    dget = tables.double.get
+    tget = tables.triple.get
+
+    pos = 0
+    while pos < length:
+        # ASCII chars
+        mo = search(data, pos)
+        if mo is None:
+            rappend(data[pos:].tobytes())
+            pos = length
+            break
+        nextpos = mo.start()
+        if nextpos != pos:
+            rappend(data[pos:nextpos].tobytes())
+            pos = nextpos
+
+        o = data[pos]
+        size = 1
+        if o in combining and pos + 1 < length:
+            o1 = data[pos + 1]
+            if o1 in combining and pos + 2 < length:
+                size = 3
+                r = tget((o << 16) | (o1 << 8) | data[pos + 2])
+            else:
+                size = 2
+                r = dget((o << 8) | o1)
+            if r is not None:
+                rappend(r)
+                pos += size
+                continue
+
+        r = fallback[o]
+        if r is not None:
+            rappend(r)
+            pos += 1
+            continue
+        if errors == "strict":
+            raise UnicodeError("Can't decode byte%s %r at position %i (context %r)" %
+                               ("" if size == 1 else "s",
+                                data[pos:pos + size].tobytes(),
+                                pos, data[max(pos - 3, 0):pos + 3].tobytes()))
+        elif errors == "replace":
+            rappend(replacement)
+        elif errors == "ignore":
+            pass
+        elif errors == "repr":
+            rappend(b'\\x%x' % o)
+        else: # pragma: no cover
+            # should never be reached
+            raise ValueError("Invalid errors argument %s" % errors)
+        pos += 1
+
+    return b"".join(result), pos
 
 
 ### Codec APIs
@@ -131,6 +282,24 @@ class Codec(codecs.Codec):
         return decode(input, errors)
 
 
+class IncrementalDecoder(codecs.BufferedIncrementalDecoder):
+
+    def _buffer_decode(self, input, errors, final):
+        if not final:
+            # keep trailing combining chars until their base char arrives
+            input = input[:len(input) - combining_tail(input, _combining)]
+        return decode(input, errors)
+
+
+class IncrementalEncoder(BufferedIncrementalEncoder):
+
+    def _tables(self):
+        return _lazy('_text_encode_tables')
+
+    def _encode_into(self, input, buffer, errors, tables):
+        return encode_into(input, buffer, errors, tables)
+
+
 class StreamWriter(Codec, codecs.StreamWriter):
     pass
 
@@ -144,6 +313,8 @@ codecInfo = codecs.CodecInfo(
     name='marc',
     encode=Codec().encode,
     decode=Codec().decode,
+    incrementalencoder=IncrementalEncoder,
+    incrementaldecoder=IncrementalDecoder,
     streamreader=StreamReader,
     streamwriter=StreamWriter)
 
@@ -757,8 +928,39 @@ unicodemap = {
     '\u266f': b'\xc4', # MUSIC SHARP SIGN
 }
 
-charmap = {}
-for uni, char in getattr(unicodemap, "iteritems", unicodemap.items)():
-    if char in charmap:
-        continue
-    charmap[char] = uni
+def _build_charmap():
+    charmap = {}
+    for uni, char in unicodemap.items():
+        if char in charmap:
+            continue
+        charmap[char] = uni
+    return charmap
+
+
+# charmap and the compiled tables are built on first use, workers that
+# decode with shared tables (see sharedtables) never build them
+_builders = {
+    'charmap': _build_charmap,
+    '_encode_tables': lambda: EncodeTables(unicodemap),
+    # text files also need line breaks, see IncrementalEncoder
+    '_text_encode_tables': lambda: EncodeTables(
+        dict(unicodemap, **{"\n": b"\n", "\r": b"\r"})),
+    '_tables': lambda: CharTables(_lazy('charmap')),
+    }
+
+
+def _lazy(name):
+    """Return charmap or a compiled table, build it on first use
+    """
+    tables = globals()
+    try:
+        return tables[name]
+    except KeyError:
+        value = tables[name] = _builders[name]()
+        return value
+
+
+def __getattr__(name):
+    if name in _builders:
+        return _lazy(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : parallel decoding
+#=============================================================================
+"""parallel decoding
+
+decode_parallel() decodes an iterable of records in an executor. Records
+are sent in batches and only a few batches are in flight, so large dumps
+are never loaded at once::
+
+    with open("dump.mab", "rb") as f:
+        for text in decode_parallel(iter_records(f), "mab2"):
+            ...
+
+The codecs are pure Python and hold the GIL. Threads only overlap decoding
+with I/O, unless the interpreter is built without GIL. Pass a
+ProcessPoolExecutor to scale CPU bound decoding across cores.
+
+Run ``python -m smc.bibencodings.parallel [FILE ...]`` for a benchmark.
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from timeit import default_timer
+from smc.bibencodings.utils import iter_records
+
+
+def _decode_batch(encoding, errors, batch):
+    decode = codecs.lookup(encoding).decode
+    return [decode(record, errors)[0] for record in batch]
+
+
+def _batches(records, batchsize):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batchsize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def decode_parallel(records, encoding='mab2', errors='strict', executor=None,
+                    workers=None, batchsize=64):
+    """Decode an iterable of records, yields texts in order
+
+    executor: a concurrent.futures executor. A ThreadPoolExecutor with
+      *workers* threads is created and shut down if it's None.
+    batchsize: number of records per task
+    """
+    codecs.lookup(encoding)
+    own = executor is None
+    if own:
+        executor = ThreadPoolExecutor(workers or os.cpu_count() or 1)
+    # bound the number of pending batches
+    inflight = 2 * (workers or os.cpu_count() or 1)
+    pending = deque()
+    try:
+        for batch in _batches(records, batchsize):
+            pending.append(executor.submit(_decode_batch, encoding, errors,
+                                           batch))
+            if len(pending) >= inflight:
+                for text in pending.popleft().result():
+                    yield text
+        while pending:
+            for text in pending.popleft().result():
+                yield text
+    finally:
+        for future in pending:
+            future.cancel()
+        if own:
+            executor.shutdown()
+
+
+def benchmark(records, encoding='mab2', workers=(1, 2, 4, 8), batchsize=64):
+    """Compare serial, thread and process decoding
+
+    Returns a list of (name, workers, seconds).
+    """
+    results = []
+    start = default_timer()
+    _decode_batch(encoding, 'strict', records)
+    results.append(("serial", 1, default_timer() - start))
+    for pool in (ThreadPoolExecutor, ProcessPoolExecutor):
+        for n in workers:
+            with pool(n) as executor:
+                # warm up workers
+                list(decode_parallel(records[:n], encoding,
+                                     executor=executor, batchsize=1))
+                start = default_timer()
+                for _ in decode_parallel(records, encoding,
+                                         executor=executor, workers=n,
+                                         batchsize=batchsize):
+                    pass
+                results.append((pool.__name__, n, default_timer() - start))
+    return results
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if not args:
+        here = os.path.dirname(os.path.abspath(__file__))
+        args = [os.path.join(here, "testdata", "record_%i.mab" % i)
+                for i in range(10)]
+    records = []
+    for name in args:
+        with open(name, "rb") as f:
+            records.extend(iter_records(f))
+    # at least 8 MB of data
+    size = sum(len(record) for record in records)
+    records = records * max(1, (8 << 20) // size)
+    size = sum(len(record) for record in records)
+    print("%i records, %.1f MB, %i CPUs" % (len(records), size / 1e6,
+                                            os.cpu_count() or 1))
+    for name, n, elapsed in benchmark(records):
+        print("%-20s %2i  %6.3fs  %6.1f MB/s" % (name, n, elapsed,
+                                                 size / elapsed / 1e6))
+
+
+if __name__ == "__main__": # pragma: no cover
+    main()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : record decoding
+#=============================================================================
+"""record decoding
+
+A MAB2 record in diskette format consists of a 24 bytes leader and fields
+of a three char tag, one char indicator and the value, each field is
+terminated by 0x1e and the record by 0x1d.
+
+Some files mix records in MAB2 and MARC encoding. RecordDecoder picks the
+codec for each record from cheap byte statistics (see detect) so every
+record is decoded exactly once.
+"""
+from __future__ import unicode_literals, print_function
+import re
+from functools import lru_cache
+from smc.bibencodings import detect
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings.utils import iter_records, RECORD_TERMINATOR
+from smc.bibencodings.validate import get_validator
+
+CODECS = {
+    'mab2': iso5426.codecInfo,
+    'mab2-xe0': iso5426.specialXE0CodecInfo,
+    'marc': marc.codecInfo,
+    }
+
+FIELD_TERMINATOR = b'\x1e'
+MAB2_LEADER_SIZE = 24
+MARC_LEADER_SIZE = 24
+
+_ascii = bytes(bytearray(range(0x80)))
+_mab2_source = re.compile(b'\x1e026.([A-Za-z]+)')
+
+
+def mab2_source(record):
+    """Return the source of a MAB2 record
+
+    The source is the alphabetic prefix of field 026, e.g. b'HBZ' or b'HEB'.
+    """
+    mo = _mab2_source.search(record)
+    if mo is None:
+        return None
+    return mo.group(1)
+
+
+def _tagset(tags):
+    """Convert an iterable of tags (str or bytes) to a frozenset of bytes
+    """
+    if tags is None:
+        return None
+    return frozenset(tag.encode("ascii") if not isinstance(tag, bytes) else tag
+                     for tag in tags)
+
+
+@lru_cache(64)
+def _mab2_tag_search(tags):
+    """Compiled regex that finds the fields in tags (a frozenset of bytes)
+    """
+    alternatives = b"|".join(re.escape(tag) for tag in sorted(tags))
+    return re.compile(b"\x1e(" + alternatives + b")([^\x1e]?)([^\x1e]*)"
+                      ).finditer
+
+
+def iter_mab2_fields(record, tags=None):
+    """Iterate over the fields of a MAB2 record
+
+    Yields (tag, indicator, value) as bytes. tags is an optional iterable
+    of tags, other fields are skipped by a regex search for the field
+    terminator followed by one of the tags.
+    """
+    end = len(record)
+    if record.endswith(RECORD_TERMINATOR):
+        end -= len(RECORD_TERMINATOR)
+    find = record.find
+    pos = MAB2_LEADER_SIZE
+    if tags is not None:
+        tags = _tagset(tags)
+        if not tags or pos >= end:
+            return
+        # the first field follows the leader without a field terminator
+        stop = find(FIELD_TERMINATOR, pos, end)
+        if stop == -1:
+            stop = end
+        tag = record[pos:pos + 3]
+        if tag in tags:
+            value = min(pos + 4, stop)
+            yield tag, record[pos + 3:value], record[value:stop]
+        for mo in _mab2_tag_search(tags)(record, stop, end):
+            yield mo.groups()
+        return
+    while pos < end:
+        stop = find(FIELD_TERMINATOR, pos, end)
+        if stop == -1:
+            stop = end
+        # the indicator of an empty field is empty
+        value = min(pos + 4, stop)
+        yield record[pos:pos + 3], record[pos + 3:value], record[value:stop]
+        pos = stop + 1
+
+
+def decode_mab2_fields(record, decode, tags=None):
+    """Decode the fields of a MAB2 record
+
+    decode is called with the value of each field, e.g. DecodeCache.decode.
+    Returns a list of (tag, indicator, value) tuples. Only the fields in
+    tags are decoded if tags is given.
+    """
+    return [(tag.decode("ascii"), indicator.decode("ascii"), decode(value))
+            for tag, indicator, value in iter_mab2_fields(record, tags)]
+
+
+def iter_marc_fields(record, tags=None):
+    """Iterate over the fields of an ISO 2709 MARC record
+
+    Yields (tag, indicators, value) as bytes, indicators is empty for
+    control fields. The fields are located with the directory, fields not in
+    tags are never touched.
+    """
+    tags = _tagset(tags)
+    try:
+        base = int(record[12:17])
+    except ValueError:
+        raise ValueError("Invalid base address %r" % record[12:17])
+    for pos in range(MARC_LEADER_SIZE, base - 1, 12):
+        tag = record[pos:pos + 3]
+        if tags is not None and tag not in tags:
+            continue
+        length = int(record[pos + 3:pos + 7])
+        start = base + int(record[pos + 7:pos + 12])
+        # strip field terminator
+        stop = start + length - 1
+        if tag < b"010":
+            yield tag, b"", record[start:stop]
+        else:
+            yield tag, record[start:start + 2], record[start + 2:stop]
+
+
+def decode_marc_fields(record, decode, tags=None):
+    """Decode the fields of an ISO 2709 MARC record
+
+    Returns a list of (tag, indicators, value) tuples.
+    """
+    return [(tag.decode("ascii"), indicators.decode("ascii"), decode(value))
+            for tag, indicators, value in iter_marc_fields(record, tags)]
+
+
+class RecordDecoder(object):
+    """Decode records with per record encoding detection
+
+    source: optional callable that returns a key for the origin of a record,
+      e.g. mab2_source. The encoding of the last record with non-ASCII chars
+      is cached per source and reused as long as it can decode the records
+      of the source.
+    """
+
+    def __init__(self, encodings=('mab2', 'mab2-xe0', 'marc'),
+                 errors='strict', source=None):
+        for name in encodings:
+            if name not in CODECS:
+                raise LookupError("Unsupported encoding %s" % name)
+        self.encodings = tuple(encodings)
+        self.errors = errors
+        self.source = source
+        self._sources = {}
+        self.hits = 0
+        self.misses = 0
+
+    def choose(self, record):
+        """Choose the encoding name for a record
+        """
+        source = self.source(record) if self.source is not None else None
+        if source is not None:
+            encoding = self._sources.get(source)
+            if (encoding is not None and
+                    get_validator(encoding).is_valid(record)):
+                self.hits += 1
+                return encoding
+            self.misses += 1
+        scores = detect.score(record, self.encodings)
+        encoding = max(scores, key=scores.get)
+        if source is not None and record.translate(None, _ascii):
+            self._sources[source] = encoding
+        return encoding
+
+    def decode(self, record):
+        """Decode a record, returns (text, encoding)
+        """
+        encoding = self.choose(record)
+        text = CODECS[encoding].decode(record, self.errors)[0]
+        return text, encoding
+
+    def decode_fields(self, record, tags=None):
+        """Decode the fields of a MAB2 record, returns (fields, encoding)
+
+        Only the fields in tags are decoded if tags is given.
+        """
+        encoding = self.choose(record)
+        decode = CODECS[encoding].decode
+        errors = self.errors
+        fields = decode_mab2_fields(record, lambda v: decode(v, errors)[0],
+                                    tags)
+        return fields, encoding
+
+    def iterdecode(self, stream, terminator=RECORD_TERMINATOR,
+                   blocksize=65536):
+        """Decode all records of a binary stream
+
+        Yields (text, encoding) for every record.
+        """
+        decode = self.decode
+        for record in iter_records(stream, terminator, blocksize):
+            yield decode(record)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : shared binary codec tables
+#=============================================================================
+"""shared binary codec tables
+
+pack_tables() stores the CharTables of a codec in an immutable binary form
+without pointers, BinaryTables reads the tables from any buffer. The buffer
+can live in multiprocessing shared memory or in an mmap'd file, so worker
+processes share one physical copy of the tables::
+
+    shm = share_tables("mab2")              # parent
+    tables = attach_tables(shm.name)        # worker
+    text = tables.decode(record)
+
+BinaryTables has the attributes of CharTables and can be passed to the
+decode() functions of iso5426 and marc as tables argument. A worker never
+builds the compiled tables of the codec modules. Entries are decoded on
+first use, a worker keeps at most 256 entries of the single byte tables
+and CACHE_SIZE entries of the double and triple tables in LRU caches.
+
+Layout (native byte order, uint32 arrays):
+  header: magic b"SMCTBL01", byte order mark, codec name (16 bytes),
+    double count, triple count, string pool size
+  single, special: 256 (offset, length) pairs each, length 0xffffffff
+    is None
+  double, triple: sorted keys, (offset, length) pairs
+  string pool: UTF-8 text of all entries
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError: # pragma: no cover
+    shared_memory = resource_tracker = None
+
+MAGIC = b"SMCTBL01"
+BOM = 0x01020304
+HEADER = struct.Struct("=8sI16sIII")
+NONE = 0xffffffff
+# decoded entries of a double or triple table that are kept per process
+CACHE_SIZE = 512
+
+# codec name -> codec module, name of the compiled tables. The modules
+# build their tables on first access, only pack_tables() needs them.
+_codecs = {
+    'iso-5426': (iso5426, '_tables'),
+    'iso-5426-xe0': (iso5426, '_xe0_tables'),
+    'marc': (marc, '_tables'),
+    }
+
+# SharedMemory names created by share_tables() in this process
+_created = set()
+
+
+def _lookup(encoding):
+    name = codecs.lookup(encoding).name
+    if name not in _codecs:
+        raise LookupError("Unsupported encoding %s" % encoding)
+    return name
+
+
+def pack_tables(encoding, tables=None):
+    """Pack the CharTables of a codec, returns bytes
+
+    tables defaults to the compiled tables of the codec.
+    """
+    name = _lookup(encoding)
+    if tables is None:
+        module, attr = _codecs[name]
+        tables = getattr(module, attr)
+    pool = bytearray()
+    offsets = {}
+
+    def entry(value):
+        if value is None:
+            return (0, NONE)
+        data = value.encode("utf-8")
+        offset = offsets.get(data)
+        if offset is None:
+            offset = offsets[data] = len(pool)
+            pool.extend(data)
+        return (offset, len(data))
+
+    parts = []
+    for values in (tables.single, tables.special):
+        pairs = array("I")
+        for value in values:
+            pairs.extend(entry(value))
+        parts.append(pairs)
+    for mapping in (tables.double, tables.triple):
+        keys = array("I", sorted(mapping))
+        pairs = array("I")
+        for key in keys:
+            pairs.extend(entry(mapping[key]))
+        parts.append(keys)
+        parts.append(pairs)
+    header = HEADER.pack(MAGIC, BOM, name.encode("ascii"), len(tables.double),
+                         len(tables.triple), len(pool))
+    return b"".join([header] + [part.tobytes() for part in parts] +
+                    [bytes(pool)])
+
+
+def _entries(pairs, pool):
+    """Return a function that decodes the entry at an index of pairs
+    """
+    def value(index):
+        length = pairs[2 * index + 1]
+        if length == NONE:
+            return None
+        offset = pairs[2 * index]
+        return str(pool[offset:offset + length], "utf-8")
+    return value
+
+
+class _Sequence(object):
+    """256 entries indexed by byte value
+    """
+
+    __slots__ = ("_lookup",)
+    def __init__(self, lookup):
+        self._lookup = lookup
+
+    def __len__(self):
+        return 256
+
+    def __getitem__(self, index):
+        if not 0 <= index < 256:
+            raise IndexError(index)
+        return self._lookup(index)
+
+
+class _Mapping(object):
+    """entries keyed by sorted integer keys, has get() like a dict
+    """
+
+    __slots__ = ("_keys", "get")
+    def __init__(self, keys, pairs, pool):
+        self._keys = keys
+        value = _entries(pairs, pool)
+        count = len(keys)
+
+        def get(key, default=None):
+            index = bisect_left(keys, key)
+            if index < count and keys[index] == key:
+                return value(index)
+            return default
+        # the decoders call get() directly, the LRU cache is implemented in C
+        self.get = lru_cache(CACHE_SIZE)(get)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+
+class BinaryTables(object):
+    """CharTables view of a buffer from pack_tables()
+
+    buffer is any object with buffer interface, e.g. bytes, an mmap or the
+    buf of a SharedMemory. The buffer must stay alive and unchanged.
+    """
+
+    def __init__(self, buffer, owner=None):
+        data = memoryview(buffer).cast("B")
+        if len(data) < HEADER.size:
+            raise ValueError("buffer is too small")
+        magic, bom, name, ndouble, ntriple, poolsize = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("buffer doesn't contain codec tables")
+        if bom != BOM:
+            raise ValueError("codec tables have a different byte order")
+        self.name = name.rstrip(b"\0").decode("ascii")
+        if self.name not in _codecs:
+            raise ValueError("Unsupported encoding %s" % self.name)
+        # keeps the SharedMemory or mmap alive
+        self.owner = owner
+        sizes = [512, 512, ndouble, 2 * ndouble, ntriple, 2 * ntriple]
+        end = HEADER.size + 4 * sum(sizes) + poolsize
+        if len(data) < end:
+            raise ValueError("codec tables are truncated")
+        arrays = []
+        pos = HEADER.size
+        for size in sizes:
+            arrays.append(data[pos:pos + 4 * size].cast("I"))
+            pos += 4 * size
+        pool = data[pos:pos + poolsize]
+        self._views = [data, pool] + arrays
+        single = lru_cache(256)(_entries(arrays[0], pool))
+        special = lru_cache(256)(_entries(arrays[1], pool))
+
+        def fallback(index):
+            value = special(index)
+            if value is None:
+                value = single(index)
+            return value
+        self._caches = [single, special, lru_cache(256)(fallback)]
+        self.single = _Sequence(single)
+        self.special = _Sequence(special)
+        self.fallback = _Sequence(self._caches[2])
+        self.double = _Mapping(arrays[2], arrays[3], pool)
+        self.triple = _Mapping(arrays[4], arrays[5], pool)
+        self._caches.extend([self.double.get, self.triple.get])
+        self.size = end
+
+    def decode(self, input, errors='strict'):
+        """Decode with the decode function of the codec and these tables
+        """
+        module, attr = _codecs[self.name]
+        return module.decode(input, errors, tables=self)[0]
+
+    def close(self):
+        """Release the buffer and close the owner
+        """
+        for cache in self._caches:
+            cache.cache_clear()
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self.owner is not None:
+            self.owner.close()
+            self.owner = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def share_tables(encoding):
+    """Copy the packed tables of a codec to a new SharedMemory
+
+    The caller owns the SharedMemory and has to close() and unlink() it.
+    """
+    data = pack_tables(encoding)
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    _created.add(shm.name)
+    return shm
+
+
+def attach_tables(name):
+    """Return the BinaryTables of a SharedMemory from share_tables()
+
+    The SharedMemory isn't tracked, the resource tracker of a worker would
+    unlink it when the worker exits.
+    """
+    try:
+        shm = shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the SharedMemory. The creator
+        # process and forked children share one registration for unlink().
+        shm = shared_memory.SharedMemory(name)
+        if name not in _created:
+            resource_tracker.unregister(shm._name, "shared_memory")
+    return BinaryTables(shm.buf, shm)
+
+
+def write_tables(encoding, filename):
+    """Write the packed tables of a codec to a file
+    """
+    with open(filename, "wb") as f:
+        f.write(pack_tables(encoding))
+
+
+def map_tables(filename):
+    """Return the BinaryTables of a file from write_tables(), read with mmap
+    """
+    with open(filename, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return BinaryTables(mm, mm)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : codec instrumentation
+#=============================================================================
+"""codec instrumentation
+
+The encode and decode functions of iso5426 and marc count which code paths
+they take once instrumentation is enabled. It's disabled by default and
+costs a single check per call and per non-ASCII char when disabled::
+
+    with stats.collect() as s:
+        data.decode("mab2")
+    print(s.denormalized, s.decode_time)
+
+The counters are global, enable instrumentation in one thread only.
+
+``python -m smc.bibencodings.stats FILE --encoding mab2`` decodes a dump
+with a streaming decoder and reports the counters, the most frequent
+non-ASCII sequences, unmapped bytes and the throughput.
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import codecs
+from collections import Counter
+from contextlib import contextmanager
+from timeit import default_timer
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings import variants
+from smc.bibencodings.compression import open_compressed
+
+_modules = (iso5426, marc)
+
+# codec name -> codec module, special map
+_codecs = {
+    'iso-5426': (iso5426, None),
+    'iso-5426-xe0': (iso5426, iso5426.special_xe0_map),
+    'marc': (marc, None),
+    }
+
+
+class Stats(object):
+    """Counters of the codec code paths
+
+    decode:
+      ascii: ASCII bytes
+      double: double combined char found in table (3 bytes)
+      decomposed: double combined char built from combining chars (3 bytes)
+      combined: combined char found in table (2 bytes)
+      denormalized: char + combining char, ISO-5426 only (2 bytes)
+      special: byte from the special table, ISO-5426 only
+      single: other non-ASCII bytes
+      errors: undecodable bytes
+
+    encode:
+      reordered: combining chars moved in front of their char, ISO-5426 only
+      encode_errors: unencodable chars
+
+    sequences: Counter of the decoded non-ASCII byte sequences
+    unmapped: Counter of the undecodable byte values
+    """
+
+    counters = ("decode_calls", "decode_bytes", "decode_time", "ascii",
+                "double", "decomposed", "combined", "denormalized",
+                "special", "single", "errors", "encode_calls", "encode_chars",
+                "encode_time", "reordered", "encode_errors")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        for name in self.counters:
+            setattr(self, name, 0)
+        self.sequences = Counter()
+        self.unmapped = Counter()
+
+    def add_decode(self, size, ascii, elapsed):
+        self.decode_calls += 1
+        self.decode_bytes += size
+        self.ascii += ascii
+        self.decode_time += elapsed
+
+    def add_encode(self, size, elapsed):
+        self.encode_calls += 1
+        self.encode_chars += size
+        self.encode_time += elapsed
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.counters)
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__,
+                            " ".join("%s=%s" % (name, getattr(self, name))
+                                     for name in self.counters))
+
+
+def get_stats():
+    """Return the active Stats object or None
+    """
+    return iso5426._stats
+
+
+def enable(stats=None):
+    """Enable instrumentation, returns the Stats object
+    """
+    if stats is None:
+        stats = Stats()
+    for module in _modules:
+        module._stats = stats
+    return stats
+
+
+def disable():
+    """Disable instrumentation, returns the last Stats object
+    """
+    stats = get_stats()
+    for module in _modules:
+        module._stats = None
+    return stats
+
+
+@contextmanager
+def collect():
+    """Collect stats for a block of code
+    """
+    previous = get_stats()
+    stats = enable()
+    try:
+        yield stats
+    finally:
+        if previous is None:
+            disable()
+        else:
+            enable(previous)
+
+
+def profile(stream, encoding='mab2', errors='replace', blocksize=1 << 20):
+    """Decode a binary stream with instrumentation
+
+    stream is a binary file or a file name, compressed files are read
+    transparently. The text is discarded. Returns (stats, bytes, seconds).
+    """
+    if not hasattr(stream, "read"):
+        with open_compressed(stream) as f:
+            return profile(f, encoding, errors, blocksize)
+    decode = codecs.getincrementaldecoder(encoding)(errors).decode
+    size = 0
+    start = default_timer()
+    with collect() as stats:
+        while True:
+            data = stream.read(blocksize)
+            if not data:
+                break
+            size += len(data)
+            decode(data)
+        decode(b"", True)
+    return stats, size, default_timer() - start
+
+
+def _charmaps(name):
+    """Return the codec module, charmap and special map of a codec
+    """
+    variant = variants.get_variant(name)
+    if variant is not None:
+        return variant.module, variant.charmap, variant.special
+    module, special = _codecs.get(name, (None, None))
+    if module is None:
+        return None, {}, None
+    return module, module.charmap, special
+
+
+def _rate(size, seconds):
+    return size / seconds / 1e6 if seconds else 0.0
+
+
+def report(stats, size, elapsed, encoding='mab2', top=20):
+    """Format the result of profile() as list of lines
+    """
+    name = codecs.lookup(encoding).name
+    module, charmap, special = _charmaps(name)
+    lines = ["%i bytes, %s, %.2f s, %.1f MB/s (decoder %.1f MB/s)" %
+             (size, name, elapsed, _rate(size, elapsed),
+              _rate(size, stats.decode_time))]
+    for counter in ("ascii", "double", "decomposed", "combined",
+                    "denormalized", "special", "single", "errors"):
+        lines.append("%-14s %12i" % (counter, getattr(stats, counter)))
+    total = sum(stats.sequences.values())
+    lines.append("")
+    lines.append("%i distinct non-ASCII sequences, top %i:" %
+                 (len(stats.sequences), top))
+    for key, count in stats.sequences.most_common(top):
+        text = key.decode(name, "replace")
+        table = key
+        if module is iso5426:
+            # 0xc9 is an alias of 0xc8
+            table = key.replace(b"\xc9", b"\xc8")
+        if table in charmap or (special is not None and table in special):
+            where = "table"
+        else:
+            where = "built"
+        lines.append("  %-10s %-10s %-5s %12i %6.2f%%" %
+                     (key.hex(" "), ascii(text), where, count,
+                      100.0 * count / total))
+    if stats.unmapped:
+        lines.append("")
+        lines.append("unmapped bytes:")
+        for byte, count in sorted(stats.unmapped.items()):
+            lines.append("  %02x %12i" % (byte, count))
+    return lines
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m smc.bibencodings.stats",
+        description="profile the decoding of a dump")
+    parser.add_argument("filename")
+    parser.add_argument("--encoding", default="mab2")
+    parser.add_argument("--errors", default="replace",
+                        choices=["strict", "replace", "ignore", "repr"])
+    parser.add_argument("--top", type=int, default=20,
+                        help="number of sequences in the histogram")
+    parser.add_argument("--blocksize", type=int, default=1 << 20)
+    options = parser.parse_args(args)
+    stats, size, elapsed = profile(options.filename, options.encoding,
+                                   options.errors, options.blocksize)
+    for line in report(stats, size, elapsed, options.encoding, options.top):
+        print(line)
+
+
+if __name__ == "__main__": # pragma: no cover
+    main()
@@ -15,10 +15,43 @@ try:
     import unittest2
 except ImportError:
     import unittest as unittest2
+import array
+import asyncio
+import bz2
+import gzip
+import lzma
+import codecs
+import io
+import mmap
+import tempfile
+import shutil
+import random
+import subprocess
+import sys
 from glob import glob
 from smc.bibencodings import iso5426
 from smc.bibencodings import marc
-from smc.bibencodings.utils import DecodeIterator
+from smc.bibencodings.utils import CharTables, DecodeIterator, combining_tail
+from smc.bibencodings.utils import iter_records
+from smc.bibencodings.validate import get_validator, RecordValidator
+from smc.bibencodings import detect
+from smc.bibencodings import records
+from smc.bibencodings import stats
+from smc.bibencodings.cache import DecodeCache
+from smc.bibencodings.writers import MAB2Writer, MARCWriter
+from smc.bibencodings.parallel import decode_parallel
+from smc.bibencodings import index
+from smc.bibencodings import compression
+from smc.bibencodings import fuzz
+from smc.bibencodings import corpus
+from smc.bibencodings.canonical import canonicalize, canonical_tables
+from smc.bibencodings import fingerprint
+from smc.bibencodings import utf8
+from smc.bibencodings import variants
+from smc.bibencodings import sharedtables
+from smc.bibencodings import textio
+from smc.bibencodings import aio
+import smc.bibencodings
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 TESTMABS = glob(os.path.join(HERE, "testdata", "record_?.mab"))
@@ -30,38 +63,1268 @@ except NameError:
 
 class TestBibencodingUtils(unittest2.TestCase):
     def test_decodeiterator(self):
-        di = DecodeIterator("")
+        a, b, c = bytearray(b"abc")
+        di = DecodeIterator(b"")
         self.assertEqual(len(di), 0)
         self.assertEqual(list(di), [])
 
-        di = DecodeIterator("abc")
+        di = DecodeIterator(b"abc")
         self.assertEqual(len(di), 3)
-        self.assertEqual(list(di), ['a', 'b', 'c'])
+        self.assertEqual(list(di), [a, b, c])
         #self.assertEqual(di[1:3], "bc")
 
-        di = DecodeIterator("abc")
+        di = DecodeIterator(b"abc")
         it = iter(di)
         self.assertEqual(di.position, 0)
-        self.assertEqual(next(it), "a")
-        self.assertEqual(di.peek(1), ["b"])
-        self.assertEqual(di.peek(2), ["b", "c"])
-        self.assertEqual(di.peek(3), ["b", "c", None])
-        self.assertEqual(next(it), "b")
-        self.assertEqual(di.peek(2), ["c", None])
-        self.assertEqual(next(it), "c")
+        self.assertEqual(next(it), a)
+        self.assertEqual(di.peek(1), [b])
+        self.assertEqual(di.peek(2), [b, c])
+        self.assertEqual(di.peek(3), [b, c, None])
+        self.assertEqual(next(it), b)
+        self.assertEqual(di.peek(2), [c, None])
+        self.assertEqual(next(it), c)
         self.assertEqual(di.position, 2)
         self.assertEqual(di.peek(2), [None, None])
         self.assertRaises(StopIteration, next, it)
         self.assertEqual(di.peek(2), [None, None])
         self.assertEqual(di.position, 3)
+        self.assertEqual(di.context(0), b"abc")
+        self.assertEqual(di.context(1, 1), b"ab")
 
-        di = DecodeIterator("abc")
+        di = DecodeIterator(bytearray(b"abc"))
         it = iter(di)
-        self.assertEqual(next(it), "a")
+        self.assertEqual(next(it), a)
         di.evolve(1)
-        self.assertEqual(next(it), "c")
+        self.assertEqual(next(it), c)
         di.evolve(1)
 
+        for data in (bytearray(b"abc"), memoryview(b"abc"),
+                     memoryview(array.array("B", b"abc"))):
+            self.assertEqual(list(DecodeIterator(data)), [a, b, c])
+        self.assertEqual(len(DecodeIterator(array.array("H", [1, 2]))), 4)
+
+    def test_chartables(self):
+        tables = CharTables({b"a": "a", b"\xc8": "\u0308", b"\xc8a": "\xe4",
+                             b"\xc5\xc8a": "\u01df"}, {b"\xe0": "\xe0"})
+        self.assertEqual(tables.single[0x61], "a")
+        self.assertEqual(tables.single[0xe0], None)
+        self.assertEqual(tables.special[0xe0], "\xe0")
+        self.assertEqual(tables.fallback[0xe0], "\xe0")
+        self.assertEqual(tables.fallback[0xc8], "\u0308")
+        self.assertEqual(tables.double, {0xc861: "\xe4"})
+        self.assertEqual(tables.triple, {0xc5c861: "\u01df"})
+        self.assertRaises(ValueError, CharTables, {b"abcd": "x"})
+
+    def test_combining_tail(self):
+        self.assertEqual(combining_tail(b"", iso5426._combining), 0)
+        self.assertEqual(combining_tail(b"ab", iso5426._combining), 0)
+        self.assertEqual(combining_tail(b"a\xc8", iso5426._combining), 1)
+        self.assertEqual(combining_tail(b"a\xc5\xc8", iso5426._combining), 2)
+        self.assertEqual(combining_tail(b"\xc8a", iso5426._combining), 0)
+        self.assertEqual(combining_tail(b"a\xe8", marc._combining), 1)
+
+    def test_iter_records(self):
+        data = b"abc\x1ddef\x1d\x1dgh"
+        for blocksize in (1, 2, 5, 100):
+            records = list(iter_records(io.BytesIO(data), blocksize=blocksize))
+            self.assertEqual(records, [b"abc\x1d", b"def\x1d", b"\x1d", b"gh"])
+        self.assertEqual(list(iter_records(io.BytesIO(b""))), [])
+
+
+class TestIncrementalDecoder(unittest2.TestCase):
+
+    def assertChunked(self, encoding, data):
+        expected = data.decode(encoding, "repr")
+        for size in (1, 2, 3, 7):
+            decoder = codecs.getincrementaldecoder(encoding)("repr")
+            chunks = [decoder.decode(data[i:i + size])
+                      for i in range(0, len(data), size)]
+            chunks.append(decoder.decode(b"", True))
+            self.assertEqual("".join(chunks), expected)
+
+    def test_iso5426(self):
+        decoder = codecs.getincrementaldecoder("mab2")()
+        self.assertEqual(decoder.decode(b"Benk\xc8"), "Benk")
+        self.assertEqual(decoder.decode(b"o"), "\xf6")
+        self.assertEqual(decoder.decode(b"\xc5\xc7"), "")
+        self.assertEqual(decoder.decode(b"A"), "\u01e0")
+        self.assertEqual(decoder.decode(b"\xca", True), "\u030a")
+        self.assertChunked("mab2", b"Benk\xcd\xc9o \xc5\xc7A \xc9u \xca\x1e\xc8")
+        self.assertChunked("mab2-xe0", b"gherd\xebina Micur\xe1 de R\xc9u")
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                self.assertChunked("mab2", f.read())
+
+    def test_marc(self):
+        decoder = codecs.getincrementaldecoder("marc")()
+        self.assertEqual(decoder.decode(b"abc\xe3"), "abc")
+        self.assertEqual(decoder.decode(b"\xf2a"), "\u1ead")
+        self.assertChunked("marc", b"abcdefg\xe8a\xe8o\xe8u\xe3\xf2a\xe5\xe80\xe8")
+
+
+class TestAsyncStream(unittest2.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def feed(self, data, size=3):
+        reader = asyncio.StreamReader(loop=self.loop)
+        for i in range(0, len(data), size):
+            reader.feed_data(data[i:i + size])
+        reader.feed_eof()
+        return reader
+
+    def collect(self, aiterable):
+        async def collect():
+            return [item async for item in aiterable]
+        return self.loop.run_until_complete(collect())
+
+    def test_text(self):
+        data = b"abcdefg\xc8a\xc8o\xc8u\xc3\xd6a \xc5\xc7A"
+        for threshold in (None, 0):
+            decoder = aio.StreamDecoder(self.feed(data), "mab2",
+                                        chunksize=2, threshold=threshold)
+            self.assertEqual("".join(self.collect(decoder)),
+                             "abcdefg\xe4\xf6\xfc\u1ead \u01e0")
+
+    def test_records(self):
+        records = []
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                records.append(f.read())
+        expected = [r.decode("mab2") for r in records]
+        decoder = aio.StreamDecoder(self.feed(b"".join(records), 1000),
+                                    "mab2", threshold=500)
+        self.assertEqual(self.collect(decoder.records()), expected)
+
+        reader = asyncio.StreamReader(limit=16, loop=self.loop)
+        reader.feed_data(records[0] + b"\xc8a")
+        reader.feed_eof()
+        decoder = aio.StreamDecoder(reader, "mab2")
+        result = self.collect(decoder.records())
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[1], "\xe4")
+
+
+class TestValidate(unittest2.TestCase):
+
+    def decode_error(self, data, encoding):
+        try:
+            data.decode(encoding)
+        except UnicodeError as e:
+            return int(str(e).split("position ")[1].split()[0])
+        return None
+
+    def test_validator(self):
+        v = get_validator("mab2")
+        self.assertTrue(v.is_valid(b"Benk\xcd\xc9o"))
+        self.assertTrue(v.is_valid(b"a\xc8\xc9"))
+        self.assertFalse(v.is_valid(b"a\xc9"))
+        self.assertEqual(v.errors(b"\xffab\xdcc\x7f\xc9"),
+                         [(0, b"\xff"), (3, b"\xdc"), (5, b"\x7f"), (6, b"\xc9")])
+        self.assertTrue(get_validator("mab2-xe0").is_valid(b"gherd\xebina"))
+        self.assertEqual(get_validator("marc").errors(b"a\x7f\xff"), [(2, b"\xff")])
+        self.assertRaises(LookupError, get_validator, "utf-8")
+
+    def test_validator_decode(self):
+        rnd = random.Random(42)
+        alphabet = bytearray(range(0x20, 0x100)) + bytearray(b"\xc5\xc8\xc9\xe3\xe8") * 10
+        for encoding in ("mab2", "mab2-xe0", "marc"):
+            v = get_validator(encoding)
+            for i in range(2000):
+                data = bytes(bytearray(rnd.choice(alphabet)
+                                       for i in range(rnd.randint(0, 6))))
+                pos = self.decode_error(data, encoding)
+                errors = v.errors(data)
+                self.assertEqual(v.is_valid(data), pos is None, data)
+                if pos is not None:
+                    self.assertEqual(errors[0][0], pos, data)
+            for mab in TESTMABS:
+                with open(mab, "rb") as f:
+                    data = f.read()
+                self.assertEqual(v.is_valid(data),
+                                 self.decode_error(data, encoding) is None)
+
+    def test_record_validator(self):
+        records = [b"abc\x1d", b"a\xffb\xdc\x1d", b"\xc8a\x1d", b"\xff"]
+        rv = RecordValidator("mab2")
+        reports = list(rv.scan(io.BytesIO(b"".join(records)), blocksize=3))
+        self.assertEqual(len(reports), 2)
+        self.assertEqual(reports[0].index, 1)
+        self.assertEqual(reports[0].offset, 4)
+        self.assertEqual(reports[0].length, 5)
+        self.assertEqual(reports[0].errors, [(1, b"\xff"), (3, b"\xdc")])
+        self.assertEqual(reports[1].index, 3)
+        self.assertEqual(reports[1].offset, 12)
+        self.assertEqual((rv.records, rv.invalid_records, rv.errors, rv.bytes),
+                         (4, 2, 3, 13))
+        self.assertEqual(rv.errorcounts, {b"\xff": 2, b"\xdc": 1})
+
+
+class TestDetect(unittest2.TestCase):
+
+    def test_testdata(self):
+        expected = {
+            "record_50_70_diskform_off.mab": "mab2-xe0",
+            "record_brokenplaintext2.mab": "mab2-xe0",
+            "record_hebis_marc.mab": "marc",
+            # no candidate decodes it
+            "record_plaintext.mab": None,
+            }
+        for mab in glob(os.path.join(HERE, "testdata", "*.mab")):
+            name = os.path.basename(mab)
+            self.assertEqual(detect.guess_file(mab), expected.get(name, "mab2"),
+                             name)
+
+    def test_detect(self):
+        result = detect.detect("Grüße aus Köln".encode("utf-8"))
+        self.assertEqual([name for name, score in result][0], "utf-8")
+        self.assertEqual(len(result), 4)
+        self.assertEqual(detect.guess("Grü".encode("utf-8") + b"\xc3", 4), "utf-8")
+        text = "Grüße aus Köln, Übersetzung"
+        self.assertEqual(detect.guess(text.encode("mab2")), "mab2")
+        self.assertEqual(detect.guess(text.encode("marc")), "marc")
+        self.assertEqual(detect.guess(b"gherd\xebina R\xc9u"), "mab2-xe0")
+        self.assertEqual(detect.guess(b"abc"), "mab2")
+        self.assertEqual(detect.guess(b"00100nam  2200037 a 4500abc"), "marc")
+        self.assertEqual(detect.guess(b"00100nam a2200037 a 4500abc"), "utf-8")
+        # 0x8c is undecodable in all encodings, 0x88 isn't valid UTF-8
+        self.assertEqual(detect.guess(b"far\x8cm \x88"), None)
+
+
+class TestRecords(unittest2.TestCase):
+
+    def read(self, name):
+        with open(os.path.join(HERE, "testdata", name), "rb") as f:
+            return f.read()
+
+    def test_mab2_source(self):
+        self.assertEqual(records.mab2_source(self.read("record_0.mab")), b"HBZHT")
+        self.assertEqual(records.mab2_source(self.read("record_hebis_marc.mab")), b"HEB")
+        self.assertEqual(records.mab2_source(b"abc"), None)
+
+    def test_record_decoder(self):
+        mab = [self.read("record_%i.mab" % i) for i in range(3)]
+        hebis = self.read("record_hebis_marc.mab")
+        data = mab[0] + hebis + mab[1] + hebis + mab[2]
+        expected = [(mab[0].decode("mab2"), "mab2"),
+                    (hebis.decode("marc"), "marc"),
+                    (mab[1].decode("mab2"), "mab2"),
+                    (hebis.decode("marc"), "marc"),
+                    (mab[2].decode("mab2"), "mab2")]
+
+        rd = records.RecordDecoder()
+        self.assertEqual(list(rd.iterdecode(io.BytesIO(data), blocksize=100)),
+                         expected)
+        self.assertEqual((rd.hits, rd.misses), (0, 0))
+
+        rd = records.RecordDecoder(source=records.mab2_source)
+        self.assertEqual(list(rd.iterdecode(io.BytesIO(data))), expected)
+        self.assertEqual((rd.hits, rd.misses), (2, 3))
+
+        rd = records.RecordDecoder(encodings=["marc"])
+        self.assertEqual(rd.choose(mab[0]), "marc")
+        self.assertRaises(LookupError, records.RecordDecoder, ["utf-8"])
+
+    def test_mab2_fields(self):
+        record = self.read("record_0.mab")
+        fields = list(records.iter_mab2_fields(record))
+        self.assertEqual(fields[0], (b"001", b" ", b"HT016189653"))
+        self.assertEqual(fields[-1], (b"599", b" ", b"HT016189386"))
+        fields = records.decode_mab2_fields(record, lambda v: v.decode("mab2"))
+        self.assertEqual(fields[11], ("304", "b", "Orgelbüchlein <Gott, durch "
+            "deine Güte oder Gottes Sohn ist kommen BWV 600>"))
+        self.assertEqual(list(records.iter_mab2_fields(record[:24])), [])
+        self.assertEqual(list(records.iter_mab2_fields(record[:24] + b"001 x")),
+                         [(b"001", b" ", b"x")])
+
+    def test_mab2_fields_tags(self):
+        for mab in TESTMABS:
+            record = self.read(os.path.basename(mab))
+            fields = list(records.iter_mab2_fields(record))
+            for tags in [("001",), (b"100", "331", "425"), ("599", "999"), ()]:
+                expected = [field for field in fields
+                            if field[0].decode("ascii") in tags or field[0] in tags]
+                self.assertEqual(list(records.iter_mab2_fields(record, tags)),
+                                 expected)
+        record = self.read("record_0.mab")
+        self.assertEqual(records.decode_mab2_fields(record,
+                             lambda v: v.decode("mab2"), ["100", "331"]),
+                         [("100", " ", "Bach, Johann Sebastian"),
+                          ("331", " ", "Gott, durch deine G\xfcte or Gottes Sohn "
+                           "ist kommen")])
+        self.assertEqual(list(records.iter_mab2_fields(record[:24] + b"001 x\x1e002",
+                                                       ["002"])),
+                         [(b"002", b"", b"")])
+        # empty fields, the filtered and unfiltered paths agree
+        record = record[:24] + b"100\x1e331\x1e425a\x1e002 x\x1e100"
+        self.assertEqual(list(records.iter_mab2_fields(record)),
+                         [(b"100", b"", b""), (b"331", b"", b""),
+                          (b"425", b"a", b""), (b"002", b" ", b"x"),
+                          (b"100", b"", b"")])
+        for tags in [("100",), ("331", "425"), ("100", "002")]:
+            expected = [field for field in records.iter_mab2_fields(record)
+                        if field[0].decode("ascii") in tags]
+            self.assertEqual(list(records.iter_mab2_fields(record, tags)),
+                             expected)
+
+        rd = records.RecordDecoder()
+        hebis = self.read("record_hebis_marc.mab")
+        fields, encoding = rd.decode_fields(hebis, ["026"])
+        self.assertEqual(encoding, "marc")
+        self.assertEqual(fields, [("026", " ", "HEB02487079X")])
+
+    def test_marc_fields(self):
+        out = io.BytesIO()
+        with MARCWriter(out) as writer:
+            writer.write([("001", "", "123"), ("245", "10", "\x1faGr\xfc\xdfe"),
+                          ("100", "1 ", "\x1faBach")])
+        record = out.getvalue()
+        self.assertEqual(records.decode_marc_fields(record, lambda v: v.decode("marc")),
+                         [("001", "", "123"), ("245", "10", "\x1faGr\xfc\xdfe"),
+                          ("100", "1 ", "\x1faBach")])
+        self.assertEqual(list(records.iter_marc_fields(record, ["100", b"001"])),
+                         [(b"001", b"", b"123"), (b"100", b"1 ", b"\x1faBach")])
+        self.assertRaises(ValueError, list, records.iter_marc_fields(b"x" * 24))
+
+
+class TestCache(unittest2.TestCase):
+
+    def test_cache(self):
+        cache = DecodeCache("mab2", maxsize=2, maxlength=4)
+        self.assertEqual(cache.encoding, "iso-5426")
+        self.assertEqual(cache.decode(b"\xc8a"), "\xe4")
+        self.assertEqual(cache.decode(b"\xc8a"), "\xe4")
+        self.assertEqual(cache.decode(bytearray(b"\xc8o")), "\xf6")
+        self.assertEqual(cache.decode(b"\xc8u"), "\xfc")
+        self.assertEqual(cache.decode(b"\xc8a"), "\xe4")
+        self.assertEqual(cache.decode(b"\xc8a\xc8o\xc8u"), "\xe4\xf6\xfc")
+        self.assertEqual((cache.hits, cache.misses, cache.uncached, cache.currsize),
+                         (1, 4, 1, 2))
+        cache.clear()
+        self.assertEqual((cache.hits, cache.misses, cache.uncached, cache.currsize),
+                         (0, 0, 0, 0))
+
+        cache = DecodeCache("marc", "replace")
+        self.assertEqual(cache.decode(b"\xff"), "\ufffd")
+
+    def test_mab2_fields(self):
+        cache = DecodeCache()
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                record = f.read()
+            expected = records.decode_mab2_fields(record, lambda v: v.decode("mab2"))
+            self.assertEqual(records.decode_mab2_fields(record, cache.decode), expected)
+            self.assertEqual(records.decode_mab2_fields(record, cache.decode), expected)
+        self.assertGreater(cache.hits, cache.misses)
+
+
+class TestStats(unittest2.TestCase):
+
+    def assertCounters(self, s, **kwargs):
+        counters = dict((name, getattr(s, name)) for name in kwargs)
+        self.assertEqual(counters, kwargs)
+
+    def test_collect(self):
+        self.assertIsNone(stats.get_stats())
+        with stats.collect() as s:
+            b"Benk\xcd\xc9o \xc5\xc7A \xc6m \xc8a\xff \xe0".decode("mab2-xe0")
+            b"\xff".decode("mab2", "replace")
+            "a\u0308\u0308\u0444".encode("mab2", "replace")
+        self.assertIsNone(stats.get_stats())
+        self.assertCounters(s, decode_calls=2, decode_bytes=21, ascii=8,
+                            double=1, decomposed=1, combined=1,
+                            denormalized=1, special=2, single=0, errors=1,
+                            encode_calls=1, encode_chars=4, reordered=2,
+                            encode_errors=1)
+        self.assertGreater(s.decode_time, 0)
+        self.assertEqual(s.as_dict()["double"], 1)
+
+        with stats.collect() as s:
+            b"abcdefg\xe8a\xe8o\xe8u\xe3\xf2a\xe5\xe80".decode("marc")
+            with stats.collect() as inner:
+                b"\xe8a".decode("marc")
+            self.assertIs(stats.get_stats(), s)
+        self.assertCounters(s, decode_calls=1, ascii=8, double=1, combined=3,
+                            single=2, errors=0)
+        self.assertCounters(inner, decode_calls=1, ascii=0, combined=1)
+        s.reset()
+        self.assertEqual(s.decode_calls, 0)
+
+    def test_strict_errors(self):
+        with stats.collect() as s:
+            self.assertRaises(UnicodeError, b"ab\xc8a\xffcd".decode, "mab2")
+            self.assertRaises(UnicodeError, b"a\xe8a\xff".decode, "marc")
+        self.assertCounters(s, decode_calls=2, decode_bytes=9, ascii=3,
+                            combined=2, errors=2)
+        self.assertGreater(s.decode_time, 0)
+
+    def test_enable(self):
+        s = stats.enable()
+        try:
+            self.assertIs(stats.get_stats(), s)
+            b"abc".decode("mab2")
+        finally:
+            self.assertIs(stats.disable(), s)
+        b"abc".decode("mab2")
+        self.assertCounters(s, decode_calls=1, ascii=3)
+
+    def test_sequences(self):
+        with stats.collect() as s:
+            b"ab\xc9a\xc8\xc2o\xc2\xe0x\xff\xff".decode("mab2", "replace")
+            b"\xe8a\xff".decode("marc", "replace")
+        self.assertEqual(s.sequences, {b"\xc9a": 1, b"\xc8\xc2o": 1, b"\xc2": 1,
+                                       b"\xe8a": 1})
+        self.assertEqual(s.unmapped, {0xe0: 1, 0xff: 3})
+        s.reset()
+        self.assertEqual(s.sequences, {})
+
+    def test_profile(self):
+        data = b"ab\xc9a\xc8\xc2o\xc2\xe0x\xff\xff" * 10
+        # small blocks split combining sequences
+        s, size, elapsed = stats.profile(io.BytesIO(data), blocksize=3)
+        self.assertIsNone(stats.get_stats())
+        self.assertEqual(size, len(data))
+        self.assertCounters(s, decomposed=10, combined=10, single=10, errors=30)
+        self.assertEqual(s.sequences[b"\xc9a"], 10)
+        lines = stats.report(s, size, elapsed, top=2)
+        self.assertIn("  c9 61      '\\xe4'     table           10  33.33%", lines)
+        self.assertEqual(lines[-2:], ["  e0           10", "  ff           20"])
+        self.assertIn("3 distinct non-ASCII sequences, top 2:", lines)
+        self.assertRaises(UnicodeError, stats.profile, io.BytesIO(data), "mab2", "strict")
+        self.assertIsNone(stats.get_stats())
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "dump.mrc.bz2")
+            with bz2.open(name, "wb") as f:
+                f.write(b"\xe8a" * 5)
+            s, size, elapsed = stats.profile(name, "marc")
+            self.assertEqual((s.combined, size), (5, 10))
+            self.assertIn("  e8 61      '\\xe4'     table            5 100.00%",
+                          stats.report(s, size, elapsed, "marc"))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_report_tables(self):
+        s, size, elapsed = stats.profile(io.BytesIO(b"\xe0x\xff\xc8\xc2a"),
+                                         "mab2-xe0")
+        lines = stats.report(s, size, elapsed, "mab2-xe0")
+        self.assertIn("  e0         '\\xe0'     table            1  33.33%", lines)
+        self.assertIn("  ff         '\\xff'     table            1  33.33%", lines)
+        if variants.get_variant("mab2-stats") is None:
+            variants.register_variant("mab2-stats", "mab2",
+                                      charmap={b"\xa4": "\u20ac", b"\xc8a": None})
+        s, size, elapsed = stats.profile(io.BytesIO(b"\xa4\xc8a\xc8o"),
+                                         "mab2-stats")
+        lines = stats.report(s, size, elapsed, "mab2-stats")
+        self.assertIn("  a4         '\\u20ac'   table            1  33.33%", lines)
+        self.assertIn("  c8 61      'a\\u0308'  built            1  33.33%", lines)
+        self.assertIn("  c8 6f      '\\xf6'     table            1  33.33%", lines)
+
+
+class TestWriters(unittest2.TestCase):
+
+    def test_mab2_roundtrip(self):
+        out = io.BytesIO()
+        expected = []
+        with MAB2Writer(out, buffersize=1000) as writer:
+            for mab in TESTMABS:
+                with open(mab, "rb") as f:
+                    record = f.read()
+                fields = records.decode_mab2_fields(record, lambda v: v.decode("mab2"))
+                # 0xc9 is an alias of 0xc8, the encoder emits 0xc8
+                expected.append(record.replace(b"\xc9", b"\xc8"))
+                self.assertEqual(writer.write(fields, record[:24].decode("ascii")),
+                                 len(record))
+        self.assertEqual(writer.records, len(TESTMABS))
+        self.assertEqual(out.getvalue(), b"".join(expected))
+
+    def test_mab2_writer(self):
+        out = io.BytesIO()
+        writer = MAB2Writer(out)
+        self.assertEqual(writer.writemany([[("001", " ", "x")],
+                                           [("331", " ", "Gr\xfc\xdfe")]]), 2)
+        self.assertEqual(out.getvalue(), b"")
+        writer.flush()
+        self.assertEqual(out.getvalue(),
+            b"00031nM2.01200024      h001 x\x1e\x1d"
+            b"00036nM2.01200024      h331 Gr\xc8u\xfbe\x1e\x1d")
+
+        self.assertRaises(ValueError, writer.write, [("01", " ", "x")])
+        self.assertRaises(ValueError, writer.write, [("001", " ", "x\x1ey")])
+        self.assertRaises(UnicodeError, writer.write,
+                          [("001", " ", "x"), ("002", " ", "\u20ac")])
+        self.assertRaises(ValueError, writer.write, [("001", " ", "x" * 100000)])
+        self.assertRaises(ValueError, writer.write, [], leader="00000")
+        writer.close()
+        self.assertEqual(len(out.getvalue()), 67)
+        self.assertEqual(writer.records, 2)
+
+        out = io.BytesIO()
+        MAB2Writer(out, errors="replace").write([("001", " ", "\u20ac")])
+        self.assertEqual(out.getvalue(), b"")
+
+    def test_marc_writer(self):
+        fields = [("001", "", "123"), ("245", "10", "\x1faGr\xfc\xdfe")]
+        out = io.BytesIO()
+        with MARCWriter(out) as writer:
+            self.assertEqual(writer.write(fields), 65)
+            self.assertEqual(writer.write(fields, "00000nam a2200000 a 4500"), 66)
+            self.assertEqual(writer.writemany([[]]), 1)
+        self.assertEqual(out.getvalue(),
+            b"00065nam  2200049   4500001000400000245001100004\x1e"
+            b"123\x1e10\x1faGr\xe8u\xc7e\x1e\x1d"
+            b"00066nam a2200049 a 4500001000400000245001200004\x1e"
+            b"123\x1e10\x1faGr\xc3\xbc\xc3\x9fe\x1e\x1d"
+            b"00026nam  2200025   4500\x1e\x1d")
+        self.assertEqual(writer.records, 3)
+
+        self.assertRaises(ValueError, writer.write, [("01", "", "x")])
+        self.assertRaises(ValueError, writer.write, [("001", " ", "x")])
+        self.assertRaises(ValueError, writer.write, [("245", "", "x")])
+        self.assertRaises(ValueError, writer.write, [("245", "1", "x")])
+        self.assertRaises(ValueError, writer.write, [("245", "100", "x")])
+        self.assertRaises(ValueError, writer.write, [("245", "1\xe4", "x")])
+        self.assertRaises(ValueError, writer.write, [("245", "10", "x\x1dy")])
+        self.assertRaises(ValueError, writer.write, [("245", "10", "x" * 10000)])
+        self.assertRaises(ValueError, writer.write, [("245", "10", "x" * 9000)] * 12)
+        self.assertRaises(ValueError, writer.write, [], leader="00000")
+        self.assertRaises(UnicodeError, writer.write, [("245", "10", "\u2603")])
+
+
+class TestParallel(unittest2.TestCase):
+
+    def test_decode_parallel(self):
+        data = []
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                data.append(f.read())
+        data = data * 5
+        expected = [record.decode("mab2") for record in data]
+        self.assertEqual(list(decode_parallel(data)), expected)
+        self.assertEqual(list(decode_parallel(iter(data), "iso-5426",
+                                              workers=2, batchsize=3)),
+                         expected)
+        self.assertEqual(list(decode_parallel([])), [])
+        self.assertEqual(list(decode_parallel([b"\xff"], "marc", "replace")),
+                         ["\ufffd"])
+        self.assertRaises(UnicodeError, list,
+                          decode_parallel(data + [b"\xff"], "marc", batchsize=4))
+        self.assertRaises(LookupError, decode_parallel([], "unknown").__next__)
+
+
+class TestIndex(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_mab2_index(self):
+        data = []
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                data.append(f.read())
+        data.append(b"00029nM2.01200024      h002 x\x1e\x1d")
+        datafile = os.path.join(self.tmpdir, "dump.mab")
+        with open(datafile, "wb") as f:
+            f.write(b"".join(data))
+        self.assertEqual(index.build_index(datafile), len(TESTMABS))
+
+        with index.RecordIndex(datafile) as idx:
+            self.assertEqual(len(idx), len(TESTMABS))
+            keys = list(idx.keys())
+            self.assertEqual(keys, sorted(keys))
+            for record in data[:-1]:
+                key = index.control_number(record)
+                self.assertIn(key, idx)
+                self.assertEqual(idx.get(key), record)
+                self.assertEqual(idx.decode(key.decode("ascii")),
+                                 record.decode("mab2"))
+            self.assertEqual(idx.find(index.control_number(data[1])),
+                             (len(data[0]), len(data[1])))
+            self.assertNotIn("HT0", idx)
+            self.assertNotIn("ZZ", idx)
+            self.assertEqual(idx.find(""), None)
+            self.assertRaises(KeyError, idx.get, "HT0")
+            self.assertRaises(ValueError, idx.find, "x" * 33)
+
+        with open(datafile + ".idx", "r+b") as f:
+            f.truncate(100)
+        self.assertRaises(ValueError, index.RecordIndex, datafile)
+        with open(datafile + ".idx", "wb") as f:
+            f.write(b"x" * 100)
+        self.assertRaises(ValueError, index.RecordIndex, datafile)
+        self.assertRaises(ValueError, index.build_index, datafile, format="xml")
+
+    def test_marc_index(self):
+        datafile = os.path.join(self.tmpdir, "dump.marc")
+        with open(datafile, "wb") as f:
+            with MARCWriter(f) as writer:
+                for i in range(100, 0, -1):
+                    writer.write([("001", "", "%08i" % i),
+                                  ("245", "10", "\x1fa\xdcber %i" % i)])
+                writer.write([("245", "10", "\x1faNo control number")])
+        indexfile = os.path.join(self.tmpdir, "marc.idx")
+        self.assertEqual(index.build_index(datafile, indexfile, "marc", 8), 100)
+        with index.RecordIndex(datafile, indexfile, "marc") as idx:
+            self.assertEqual(list(idx.keys()), [b"%08i" % i for i in range(1, 101)])
+            text = idx.decode("00000042")
+            self.assertTrue(text.endswith("\x1faÜber 42\x1e\x1d"), text)
+            self.assertEqual(idx.find("00000101"), None)
+
+    def test_skipped(self):
+        datafile = os.path.join(self.tmpdir, "dump.marc")
+        with open(datafile, "wb") as f:
+            with MARCWriter(f) as writer:
+                first = writer.write([("001", "", "00000002")])
+                long = writer.write([("001", "", "000000001")])
+            bad = b"00026nam  22000xx   4500\x1e\x1d"
+            f.write(bad)
+            with MARCWriter(f) as writer:
+                writer.write([("001", "", "00000001")])
+        skipped = []
+        self.assertEqual(index.build_index(datafile, None, "marc", 8,
+                                           skipped=skipped), 2)
+        self.assertEqual([(s.index, s.length) for s in skipped],
+                         [(1, long), (2, len(bad))])
+        self.assertIn("longer than 8 bytes", skipped[0].error)
+        self.assertIn("base address", skipped[1].error)
+        with index.RecordIndex(datafile, encoding="marc") as idx:
+            self.assertEqual(list(idx.keys()), [b"00000001", b"00000002"])
+            self.assertEqual(idx.find("00000001"),
+                             (first + long + len(bad), first))
+            self.assertEqual(idx.find("00000002"), (0, first))
+
+    def test_sorted_runs(self):
+        datafile = os.path.join(self.tmpdir, "dump.marc")
+        with open(datafile, "wb") as f:
+            with MARCWriter(f) as writer:
+                for i in range(50):
+                    writer.write([("001", "", "%04i" % ((i * 7) % 23))])
+        inmemory = os.path.join(self.tmpdir, "memory.idx")
+        merged = os.path.join(self.tmpdir, "merged.idx")
+        self.assertEqual(index.build_index(datafile, inmemory, "marc", 4), 50)
+        self.assertEqual(index.build_index(datafile, merged, "marc", 4,
+                                           blocksize=10, sortsize=3), 50)
+        with open(inmemory, "rb") as f1, open(merged, "rb") as f2:
+            self.assertEqual(f1.read(), f2.read())
+        with index.RecordIndex(datafile, merged, "marc") as idx:
+            keys = list(idx.keys())
+            self.assertEqual(keys, sorted(keys))
+            self.assertEqual(len(keys), 50)
+
+
+class TestCompression(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.records = []
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                self.records.append(f.read())
+        self.data = b"".join(self.records)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, "wb") as f:
+            f.write(data)
+        return filename
+
+    def test_formats(self):
+        for name, compress, fmt in [("a.mab.gz", gzip.compress, "gzip"),
+                                    ("a.mab.bz2", bz2.compress, "bzip2"),
+                                    ("a.mab.xz", lzma.compress, "xz"),
+                                    ("a.mab", bytes, None)]:
+            filename = self.write(name, compress(self.data))
+            with open(filename, "rb") as f:
+                self.assertEqual(compression.detect_compression(f), fmt)
+                self.assertEqual(f.tell(), 0)
+            self.assertEqual(list(iter_records(filename, blocksize=100)),
+                             self.records)
+            with compression.open_compressed(filename, readahead=False) as f:
+                self.assertEqual(f.read(), self.data)
+            with open(filename, "rb") as raw:
+                with compression.open_compressed(raw, blocksize=7) as f:
+                    self.assertEqual(list(iter_records(f, blocksize=5)),
+                                     self.records)
+                self.assertFalse(raw.closed)
+            with compression.open_compressed(filename) as f:
+                reader = codecs.getreader("mab2")(f)
+                self.assertEqual(reader.read(), self.data.decode("mab2"))
+            rd = records.RecordDecoder()
+            self.assertEqual([text for text, encoding in rd.iterdecode(filename)],
+                             [record.decode("mab2") for record in self.records])
+
+    def test_readahead(self):
+        stream = io.BytesIO(self.data)
+        with compression.ReadAhead(stream, blocksize=10, queuesize=1) as f:
+            self.assertEqual(f.read(3), self.data[:3])
+            self.assertEqual(f.read(100), self.data[3:10])
+            self.assertEqual(f.read(), self.data[10:])
+            self.assertEqual(f.read(1), b"")
+        self.assertTrue(stream.closed)
+        self.assertRaises(ValueError, f.read)
+
+        # close before the data is consumed stops the reader thread
+        f = compression.ReadAhead(io.BytesIO(self.data), blocksize=10)
+        f.close()
+        self.assertFalse(f._thread.is_alive())
+
+        filename = self.write("broken.gz", gzip.compress(self.data)[:-20])
+        with compression.open_compressed(filename) as f:
+            self.assertRaises(EOFError, f.read)
+
+
+class TestFuzz(unittest2.TestCase):
+
+    def test_candidates(self):
+        for encoding in ("mab2", "mab2-xe0", "marc"):
+            for name, factory in fuzz.CANDIDATES.items():
+                self.assertEqual(fuzz.compare(factory(encoding), encoding,
+                                              iterations=300), [], name)
+
+    def test_mismatch(self):
+        decode = fuzz.reference("mab2")
+        # ignores the 0xc9 alias
+        broken = lambda data, errors: decode(data.replace(b"\xc9", b"\xc0"), errors)
+        mismatches = fuzz.compare(broken, "mab2", iterations=100, maxmismatches=3)
+        self.assertEqual(len(mismatches), 3)
+        for mismatch in mismatches:
+            self.assertIn(b"\xc9", mismatch.data)
+            self.assertIn(mismatch.errors, fuzz.ERRORS)
+
+        strict = lambda data, errors: decode(data, "strict")
+        mismatches = fuzz.compare(strict, "marc", iterations=100, errors=["replace"])
+        self.assertTrue(mismatches)
+        self.assertEqual(mismatches[0].result, UnicodeError)
+
+    def test_reference(self):
+        data = b"ab\xc9a\xc8\xc2o\xc2\xe0x\xa4\xe0"
+        self.assertEqual(fuzz.decode_iso5426(data, "repr")[0],
+                         data.decode("mab2", "repr"))
+        self.assertEqual(fuzz.decode_iso5426(data, "repr",
+                                             iso5426.special_xe0_map)[0],
+                         data.decode("mab2-xe0", "repr"))
+        self.assertEqual(fuzz.decode_marc(b"a\xe8a\xe3\xf2a\xff", "repr"),
+                         ("a\xe4\u1ead\\xff", 7))
+        self.assertRaises(UnicodeError, fuzz.decode_marc, b"\xff")
+        # mab2 ignores the special map of mab2-xe0
+        mismatches = fuzz.compare(fuzz._decode_candidate("mab2"), "mab2-xe0",
+                                  iterations=100, maxmismatches=3)
+        self.assertEqual(len(mismatches), 3)
+        for mismatch in mismatches:
+            self.assertTrue(set(bytearray(mismatch.data)) &
+                            set(bytearray(b"".join(iso5426.special_xe0_map))))
+
+    def test_generator(self):
+        generate = fuzz.InputGenerator("mab2-xe0")
+        self.assertTrue(set(iso5426.special_xe0_map).issubset(generate.sequences))
+        first = fuzz.InputGenerator("mab2", seed=1)
+        second = fuzz.InputGenerator("iso5426", seed=1)
+        self.assertEqual([first() for _ in range(10)], [second() for _ in range(10)])
+        self.assertRaises(LookupError, fuzz.InputGenerator, "unknown")
+
+    def test_throughput(self):
+        results = fuzz.throughput({"buffer": fuzz._buffer_candidate("marc")},
+                                  "marc", size=1000)
+        self.assertEqual([name for name, speed in results], ["reference", "buffer"])
+
+
+class TestCorpus(unittest2.TestCase):
+
+    def generate(self, format="mab2", **kwargs):
+        out = io.BytesIO()
+        generator = corpus.CorpusGenerator(format, **kwargs)
+        count, size = generator.write(out, records=20)
+        self.assertEqual(count, 20)
+        self.assertEqual(size, len(out.getvalue()))
+        return out.getvalue()
+
+    def test_mab2(self):
+        data = self.generate(seed=1, accents=0.5, doubles=0.1)
+        self.assertEqual(data, self.generate(seed=1, accents=0.5, doubles=0.1))
+        self.assertNotEqual(data, self.generate(seed=2, accents=0.5, doubles=0.1))
+        recs = list(iter_records(io.BytesIO(data)))
+        self.assertEqual(len(recs), 20)
+        for i, record in enumerate(recs):
+            fields = records.decode_mab2_fields(record, lambda v: v.decode("mab2"))
+            self.assertEqual(fields[0], ("001", " ", "GEN%09i" % (i + 1)))
+        with stats.collect() as s:
+            data.decode("mab2")
+        self.assertGreater(s.combined, 0)
+        self.assertGreater(s.double, 0)
+
+    def test_marc(self):
+        data = self.generate("marc", record_size=(100, 200))
+        self.assertTrue(100 * 20 < len(data) < 300 * 20, len(data))
+        for record in iter_records(io.BytesIO(data)):
+            fields = records.decode_marc_fields(record, lambda v: v.decode("marc"))
+            self.assertEqual(fields[0][:2], ("001", ""))
+            for tag, indicators, value in fields:
+                if tag >= "010":
+                    self.assertEqual(indicators, "  ")
+                    self.assertTrue(value.startswith("\x1fa"))
+
+    def test_errors(self):
+        data = self.generate(error_rate=1.0)
+        for record in iter_records(io.BytesIO(data)):
+            self.assertRaises(UnicodeError, record.decode, "mab2")
+        self.assertRaises(ValueError, corpus.CorpusGenerator, "xml")
+        self.assertRaises(ValueError, corpus.CorpusGenerator().write, io.BytesIO())
+        self.assertEqual(corpus._size("2G"), 2 << 30)
+        self.assertEqual(corpus._size("1.5k"), 1536)
+        self.assertEqual(corpus._size("100"), 100)
+
+
+class TestCanonical(unittest2.TestCase):
+
+    def test_iso5426(self):
+        self.assertEqual(canonicalize(b"\xc9a"), b"\xc8a")
+        self.assertEqual(canonicalize(bytearray(b"G\xc9ute")), b"G\xc8ute")
+        self.assertEqual(canonicalize(b"x\xc9\xb0"), b"x\xc8\xb0")
+        # like the decoder: a trailing 0xc9 has no mapping
+        self.assertRaises(UnicodeError, canonicalize, b"\xc9")
+        self.assertEqual(canonicalize(b"\xe0\xa4", "mab2-xe0"), b"\xc1a\xa4")
+        self.assertEqual(canonicalize(b"\xe4\xf7", "mab2-xe0"), b"\xc8a\xf7")
+        # the 0xc9 behind a combining char without partner stays
+        self.assertEqual(canonicalize(b"\xc9\xc2\xc9u"), b"\xc8\xc2\xc9u")
+        self.assertEqual(canonicalize(b"\xc8\xe4", "mab2-xe0"), b"\xc8\xe4")
+        self.assertRaises(UnicodeError, canonicalize, b"\xc9a\x80")
+        self.assertEqual(canonicalize(b"\xc9a\x80", errors="replace"), b"\xc8a?")
+        self.assertEqual(canonicalize(b"\xc9a\x80", errors="ignore"), b"\xc8a")
+        self.assertEqual(canonicalize(b"\xc9a\x80", errors="repr"), b"\xc8a\\x80")
+        self.assertRaises(LookupError, canonicalize, b"", "utf-8")
+        self.assertRaises(LookupError, canonical_tables, "utf-8")
+
+    def test_marc(self):
+        data = "Gr\xfc\xdfe \u01e1".encode("marc")
+        self.assertEqual(canonicalize(data, "marc"), data)
+        self.assertRaises(UnicodeError, canonicalize, b"\xff", "marc")
+        self.assertEqual(canonicalize(b"a\xff", "marc", "replace"), b"a?")
+
+    def test_roundtrip(self):
+        out = io.BytesIO()
+        corpus.CorpusGenerator(seed=3, accents=0.3, doubles=0.05).write(out, records=20)
+        data = [out.getvalue()]
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                data.append(f.read())
+        tables = canonical_tables("mab2")
+        for record in data:
+            result = canonicalize(record)
+            # fast path for valid data and transcoder agree
+            self.assertEqual(result, iso5426.transcode(record, tables,
+                                                       lookahead=True)[0])
+            self.assertEqual(result.decode("mab2"), record.decode("mab2"))
+            self.assertEqual(canonicalize(result), result)
+            self.assertEqual(canonicalize(record.replace(b"\xc8", b"\xc9")), result)
+
+    def test_decode_canonical(self):
+        # decode(canonicalize(x)) == decode(x) for short sequences of
+        # combining chars, letters and specials
+        rnd = random.Random(11)
+        alphabet = [b"a", b"u", b" ", b"\xc1", b"\xc2", b"\xc8", b"\xc9",
+                    b"\xca", b"\xcf", b"\xb0", b"\xe4", b"\xfb", b"\xa4",
+                    b"\xf7"]
+        for encoding in ("mab2", "mab2-xe0"):
+            tables = canonical_tables(encoding)
+            for i in range(20000):
+                data = b"".join(rnd.choice(alphabet)
+                                for j in range(rnd.randint(1, 6)))
+                try:
+                    text = data.decode(encoding)
+                except UnicodeError:
+                    continue
+                result = canonicalize(data, encoding)
+                self.assertEqual(result.decode(encoding), text, data)
+                self.assertEqual(canonicalize(result, encoding), result, data)
+                self.assertEqual(iso5426.transcode(data, tables,
+                                                   lookahead=True)[0],
+                                 result, data)
+
+
+class TestFingerprint(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sidecar = os.path.join(self.tmpdir, "dump.fp")
+        self.records = []
+        for mab in sorted(TESTMABS):
+            with open(mab, "rb") as f:
+                self.records.append(f.read())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_detector(self, records, **kwargs):
+        detector = fingerprint.ChangeDetector(self.sidecar, **kwargs)
+        changes = list(detector.changes(io.BytesIO(b"".join(records))))
+        detector.save()
+        return detector, changes
+
+    def test_fingerprint(self):
+        record = self.records[0]
+        fp = fingerprint.fingerprint(record)
+        self.assertEqual(fp.key, b"HT016189653")
+        self.assertEqual(len(fp.digest), 16)
+        self.assertEqual(fp.fields[0][0], b"001")
+        self.assertEqual(fingerprint.fingerprint(record.replace(b"\xc8", b"\xc9")), fp)
+        other = fingerprint.fingerprint(record.replace(b"Bach", b"Back"))
+        self.assertNotEqual(other.digest, fp.digest)
+        self.assertEqual(fingerprint.changed_tags(fp, other), [b"100", b"359", b"591"])
+        # canonicalization of 0xff changes the length of field 245, the
+        # following fields are still split at the right offsets
+        out = io.BytesIO()
+        with MARCWriter(out) as writer:
+            writer.write([("001", "", "123"), ("245", "10", "\x1faGr\xfc\xdfe"),
+                          ("500", "  ", "\x1fax")])
+        record = out.getvalue()
+        fp = fingerprint.fingerprint(record, "marc", "marc")
+        broken = record.replace(b"Gr\xe8u", b"Gr\xffu")
+        other = fingerprint.fingerprint(broken, "marc", "marc")
+        self.assertEqual(other.key, b"123")
+        self.assertEqual([tag for tag, digest in other.fields],
+                         [b"001", b"245", b"500"])
+        self.assertEqual(fingerprint.changed_tags(fp, other), [b"245"])
+        # records without control number are keyed by their digest
+        fp = fingerprint.fingerprint(b"00029nM2.01200024      h002 x\x1e\x1d",
+                                     fields=False)
+        self.assertEqual((fp.key, fp.fields), (fp.digest, ()))
+
+    def test_change_detector(self):
+        detector, changes = self.run_detector(self.records)
+        self.assertEqual(len(changes), len(self.records))
+        self.assertEqual(set(change.status for change in changes), set(["new"]))
+        self.assertEqual(changes[0].record, self.records[0])
+
+        # 0xc9 instead of 0xc8 isn't a change
+        records = [record.replace(b"\xc8", b"\xc9") for record in self.records]
+        detector, changes = self.run_detector(records)
+        self.assertEqual((changes, detector.unchanged), ([], len(self.records)))
+
+        records = self.records[1:]
+        records[0] = records[0].replace(b"070 575", b"070 576")
+        detector, changes = self.run_detector(records)
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0].status, "changed")
+        self.assertEqual(changes[0].record, records[0])
+        self.assertEqual(changes[0].fields, [b"070"])
+        self.assertEqual(detector.deleted(),
+                         [fingerprint.fingerprint(self.records[0]).key])
+
+        self.assertEqual(len(fingerprint.read_fingerprints(self.sidecar)),
+                         len(records))
+        with open(self.sidecar, "r+b") as f:
+            f.truncate(os.path.getsize(self.sidecar) - 1)
+        self.assertRaises(ValueError, fingerprint.ChangeDetector, self.sidecar)
+        with open(self.sidecar, "wb") as f:
+            f.write(b"garbage")
+        self.assertRaises(ValueError, fingerprint.ChangeDetector, self.sidecar)
+        self.assertRaises(ValueError, fingerprint.ChangeDetector, "x", format="xml")
+
+
+class TestUTF8(unittest2.TestCase):
+
+    def test_to_utf8(self):
+        self.assertEqual(utf8.to_utf8(b"\xc8a"), "\xe4".encode("utf-8"))
+        self.assertEqual(utf8.to_utf8(b"\xe0\xa4", "mab2-xe0"),
+                         b"\xe0\xa4".decode("mab2-xe0").encode("utf-8"))
+        self.assertEqual(utf8.to_utf8(memoryview(b"\xe8a"), "marc"), "\xe4".encode("utf-8"))
+        self.assertRaises(UnicodeError, utf8.to_utf8, b"a\xc9")
+        self.assertEqual(utf8.to_utf8(b"a\xff", "marc", "replace"), "a\ufffd".encode("utf-8"))
+        self.assertEqual(utf8.to_utf8(b"a\xff", "marc", "repr"), b"a\\xff")
+        self.assertRaises(LookupError, utf8.to_utf8, b"", "utf-8")
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                data = f.read()
+            self.assertEqual(utf8.to_utf8(data), data.decode("mab2").encode("utf-8"))
+
+    def test_transcoder(self):
+        transcoder = utf8.UTF8Transcoder()
+        self.assertEqual(transcoder.transcode(b"a\xc2\xc8"), b"a")
+        self.assertEqual(transcoder.transcode(b"o"),
+                         b"\xc2\xc8o".decode("mab2").encode("utf-8"))
+        self.assertEqual(transcoder.transcode(b"\xc9"), b"")
+        self.assertRaises(UnicodeError, transcoder.transcode, b"", True)
+        transcoder.reset()
+        self.assertEqual(transcoder.transcode(b"", True), b"")
+
+    def test_transcode_file(self):
+        out = io.BytesIO()
+        corpus.CorpusGenerator("marc", seed=2, accents=0.3).write(out, records=20)
+        data = out.getvalue()
+        target = io.BytesIO()
+        # small blocks split combining sequences
+        self.assertEqual(utf8.transcode_file(io.BytesIO(data), target, "marc", blocksize=7),
+                         (len(data), len(target.getvalue())))
+        self.assertEqual(target.getvalue(), data.decode("marc").encode("utf-8"))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "records.mrc.gz")
+            with gzip.open(name, "wb") as f:
+                f.write(data)
+            target = io.BytesIO()
+            utf8.transcode_file(name, target, "marc")
+            self.assertEqual(target.getvalue(), data.decode("marc").encode("utf-8"))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestVariants(unittest2.TestCase):
+
+    def register(self, name, base, **kwargs):
+        # codecs caches lookups, a variant can only be registered once
+        return (variants.get_variant(name) or
+                variants.register_variant(name, base, **kwargs))
+
+    def test_iso5426(self):
+        variant = self.register("mab2-test", "mab2",
+                                charmap={b"\xa4": "\u20ac", b"\xc8a": None,
+                                         b"\xc2\xc8o": "\u1e4f"})
+        self.assertEqual(codecs.lookup("MAB2_test").name, "mab2-test")
+        self.assertIs(variants.get_variant("mab2_TEST"), variant)
+        self.assertEqual(b"\xa4$".decode("mab2-test"), "\u20ac$")
+        self.assertEqual(b"\xc8a".decode("mab2-test"), "a\u0308")
+        self.assertEqual(b"\xc2\xc8o".decode("mab2-test"), "\u1e4f")
+        self.assertEqual("\u20ac$\u1e4fa\u0308".encode("mab2-test"), b"\xa4$\xc2\xc8o\xc8a")
+        self.assertRaises(UnicodeError, "\xe4".encode, "mab2-test")
+        # the base codec is unchanged
+        self.assertEqual(b"\xa4\xc8a".decode("mab2"), "$\xe4")
+        self.assertEqual("$\xe4".encode("mab2"), b"\xa4\xc8a")
+        decoder = codecs.getincrementaldecoder("mab2-test")()
+        self.assertEqual(decoder.decode(b"\xa4\xc2"), "\u20ac")
+        self.assertEqual(decoder.decode(b"\xc8o", True), "\u1e4f")
+        reader = codecs.getreader("mab2-test")(io.BytesIO(b"\xa4abc"))
+        self.assertEqual(reader.read(), "\u20acabc")
+        out = io.BytesIO()
+        codecs.getwriter("mab2-test")(out).write("\u20ac")
+        self.assertEqual(out.getvalue(), b"\xa4")
+        buf = bytearray()
+        self.assertEqual(variant.encode_into("\u20aca", buf), (2, 2))
+        self.assertEqual(buf, b"\xa4a")
+
+    def test_replaced_chars(self):
+        # README example, '$' was encoded as 0xa4
+        self.register("mab2-opac-test", "mab2", charmap={b"\xa4": "\u20ac"})
+        self.assertEqual("$\u20ac".encode("mab2-opac-test"), b"$\xa4")
+        # another sequence still decodes to the old char
+        variant = self.register("mab2-ae-test", "mab2",
+                                charmap={b"\xc8a": "\u2603", b"\xe2": "\xe4"})
+        self.assertEqual("\xe4\u2603".encode("mab2-ae-test"), b"\xe2\xc8a")
+        self.assertEqual(b"\xe2\xc8a".decode("mab2-ae-test"), "\xe4\u2603")
+        self.assertEqual(variant._sequence("\u2603"), b"\xc8a")
+
+    def test_marc_xe0(self):
+        self.register("marc-test", "marc", charmap={b"\xff": "\u2603"})
+        self.assertEqual(b"a\xff".decode("marc-test"), "a\u2603")
+        self.assertEqual("a\u2603".encode("marc-test"), b"a\xff")
+        self.assertRaises(UnicodeError, b"\xff".decode, "marc")
+        self.register("mab2-xe0-test", "mab2-xe0", special={"\xe1": "\u2603"})
+        self.assertEqual(b"\xe0\xe1".decode("mab2-xe0-test"), "\xe0\u2603")
+        self.assertEqual(b"\xe0\xe1".decode("mab2-xe0"), "\xe0\xe1")
+
+    def test_errors(self):
+        self.assertRaises(ValueError, variants.register_variant, "mab2", "mab2")
+        self.assertRaises(ValueError, variants.register_variant, "x-test", "mab2",
+                          charmap={b"a": "b"})
+        self.assertRaises(ValueError, variants.register_variant, "x-test", "mab2",
+                          unicodemap={"ab": b"\xa4"})
+        # the decoder never looks up these sequences
+        for key in (b"\xa4a", b"\xc8\xa4a", b"\xc9a", b"\xc2\xc9o"):
+            self.assertRaises(ValueError, variants.register_variant, "x-test",
+                              "mab2", charmap={key: "x"})
+        self.assertRaises(ValueError, variants.register_variant, "x-test",
+                          "marc", charmap={b"\xa4a": "x"})
+        self.assertRaises(LookupError, variants.register_variant, "x-test", "utf-8")
+        self.assertIsNone(variants.get_variant("x-test"))
+        self.assertRaises(LookupError, codecs.lookup, "x-test")
+
+
+class TestSharedTables(unittest2.TestCase):
+
+    def test_binary_tables(self):
+        for encoding in ("mab2", "mab2-xe0", "marc"):
+            tables = sharedtables.BinaryTables(sharedtables.pack_tables(encoding))
+            self.assertEqual(fuzz.compare(lambda data, errors: tables.decode(data, errors),
+                                          encoding, iterations=300), [])
+        tables = sharedtables.BinaryTables(sharedtables.pack_tables("iso5426"))
+        self.assertEqual(tables.name, "iso-5426")
+        self.assertEqual(len(tables.double), len(iso5426._tables.double))
+        self.assertEqual(list(tables.triple), sorted(iso5426._tables.triple))
+        self.assertEqual(tables.double[0xc861], "\xe4")
+        self.assertRaises(KeyError, tables.double.__getitem__, 0x6161)
+        self.assertEqual(list(tables.single), iso5426._tables.single)
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                data = f.read()
+            self.assertEqual(iso5426.decode(data, tables=tables)[0], data.decode("mab2"))
+
+    def test_errors(self):
+        data = sharedtables.pack_tables("marc")
+        self.assertRaises(ValueError, sharedtables.BinaryTables, data[:10])
+        self.assertRaises(ValueError, sharedtables.BinaryTables, b"x" * len(data))
+        self.assertRaises(ValueError, sharedtables.BinaryTables, data[:-1])
+        self.assertRaises(LookupError, sharedtables.pack_tables, "utf-8")
+
+    def test_shared_memory(self):
+        shm = sharedtables.share_tables("marc")
+        try:
+            with sharedtables.attach_tables(shm.name) as tables:
+                self.assertEqual(tables.decode(b"\xe8a"), "\xe4")
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def test_attach_child(self):
+        # a worker process attaches the tables and exits
+        script = "\n".join([
+            "import sys",
+            "from smc.bibencodings import iso5426, marc, sharedtables",
+            "with sharedtables.attach_tables(sys.argv[1]) as tables:",
+            "    print(ascii(tables.decode(b'\\xe8a')))",
+            "print(sorted(set(iso5426._builders).intersection(vars(iso5426))),",
+            "      sorted(set(marc._builders).intersection(vars(marc))))",
+            ])
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(HERE))] +
+            [path for path in [env.get("PYTHONPATH")] if path])
+        shm = sharedtables.share_tables("marc")
+        try:
+            proc = subprocess.Popen([sys.executable, "-c", script, shm.name],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, env=env)
+            out, err = proc.communicate()
+            self.assertEqual(proc.returncode, 0, err)
+            # the worker built no compiled tables
+            self.assertEqual(out.split(b"\n")[:2], [b"'\\xe4'", b"[] []"])
+            self.assertNotIn(b"leaked", err)
+            # the resource tracker of the worker didn't unlink the tables
+            with sharedtables.attach_tables(shm.name) as tables:
+                self.assertEqual(tables.decode(b"\xe8a"), "\xe4")
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def test_mmap(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "mab2.tables")
+            sharedtables.write_tables("mab2-xe0", name)
+            with sharedtables.map_tables(name) as tables:
+                self.assertEqual(tables.decode(b"\xe0\xc8a"), "\xe0\xe4")
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestTextIO(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.name = os.path.join(self.tmpdir, "lines.mab")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        lines = ["001 GEN1\n", "331 G\xe4ste \u1e4f\n", "359 Bach\n"]
+        with smc.bibencodings.open(self.name, "w") as f:
+            self.assertEqual(f.mode, "w")
+            self.assertEqual(f.encoding, "mab2")
+            f.writelines(lines)
+        with open(self.name, "rb") as f:
+            self.assertEqual(f.read(), b"001 GEN1\n331 G\xc8aste \xc8\xc4o\n359 Bach\n")
+        # blocks of 3 bytes split combining sequences
+        with smc.bibencodings.open(self.name, blocksize=3) as f:
+            self.assertEqual(list(f), lines)
+        with smc.bibencodings.open(self.name, "a", newline="\r\n") as f:
+            f.write("x\n")
+        with smc.bibencodings.open(self.name, newline="") as f:
+            self.assertEqual(f.read().splitlines(True)[-1], "x\r\n")
+        with smc.bibencodings.open(self.name, "w", "marc", buffering=1) as f:
+            self.assertTrue(f.line_buffering)
+            f.write("\xe4\n")
+        with open(self.name, "rb") as f:
+            self.assertEqual(f.read(), b"\xe8a\n")
+
+    def test_errors(self):
+        with open(self.name, "wb") as f:
+            f.write(b"a\xff\n")
+        with smc.bibencodings.open(self.name, encoding="marc") as f:
+            self.assertRaises(UnicodeError, f.read)
+        with smc.bibencodings.open(self.name, encoding="marc", errors="repr") as f:
+            self.assertEqual(f.read(), "a\\xff\n")
+        self.assertRaises(ValueError, smc.bibencodings.open, self.name, "rb")
+        self.assertRaises(ValueError, smc.bibencodings.open, self.name, buffering=0)
+        self.assertRaises(LookupError, smc.bibencodings.open, self.name, encoding="x")
+        with smc.bibencodings.open(self.name, "w") as f:
+            self.assertRaises(UnicodeError, f.write, "\u0444")
+
+    def test_separate_writes(self):
+        text = "a\u0308x\ne\u0301"
+        with smc.bibencodings.open(self.name, "w") as f:
+            f.write("a")
+            f.write("\u0308")
+            # tell() writes the pending chars
+            self.assertEqual(f.tell(), 2)
+            f.write("x\n")
+            f.write("e")
+            f.write("\u0301")
+        data = b"\xc8ax\n\xc2e"
+        self.assertEqual(text.replace("\n", "").encode("mab2"), data.replace(b"\n", b""))
+        with open(self.name, "rb") as f:
+            self.assertEqual(f.read(), data)
+        with smc.bibencodings.open(self.name) as f:
+            self.assertEqual(f.read(), data.decode("mab2"))
+        with smc.bibencodings.open(self.name, "w", buffering=1) as f:
+            f.write("a\n")
+            with open(self.name, "rb") as raw:
+                self.assertEqual(raw.read(), b"a\n")
+        # codecs caches lookups, a variant can only be registered once
+        if variants.get_variant("mab2-textio") is None:
+            variants.register_variant("mab2-textio", "mab2",
+                                      charmap={b"\xa4": "\u20ac"})
+        with smc.bibencodings.open(self.name, "w", "mab2-textio") as f:
+            for char in "\u20aco\u0308":
+                f.write(char)
+        with open(self.name, "rb") as f:
+            self.assertEqual(f.read(), b"\xa4\xc8o")
+
+    def test_encoder_state(self):
+        self.assertEqual(b"".join(codecs.iterencode(["a", "\u0308", "x"], "mab2")),
+                         b"\xc8ax")
+        self.assertEqual(b"".join(codecs.iterencode(["a", "\u0308", "x"], "marc")),
+                         b"a\xe8x")
+        encoder = codecs.getincrementalencoder("mab2")()
+        self.assertEqual(encoder.encode("xa\u0308"), b"x")
+        state = encoder.getstate()
+        self.assertNotEqual(state, 0)
+        encoder.reset()
+        self.assertEqual(encoder.getstate(), 0)
+        self.assertEqual(encoder.encode("", True), b"")
+        encoder.setstate(state)
+        # like "xa\u0308\u0301".encode("mab2")
+        self.assertEqual(encoder.encode("\u0301", True), b"\xc8\xc2a")
+        self.assertEqual(encoder.getstate(), 0)
+        # an empty input emits the pending chars
+        self.assertEqual(encoder.encode("e"), b"")
+        self.assertEqual(encoder.encode(""), b"e")
+
+    def test_benchmark(self):
+        with open(self.name, "wb") as f:
+            f.write(b"a\xc8a\n" * 100)
+        results = textio.benchmark(self.name, repeat=1)
+        self.assertEqual([(name, lines) for name, lines, speed in results],
+                         [("open", 100), ("codecs.open", 100)])
+
 
 class Testiso5426(unittest2.TestCase):
 
@@ -120,6 +1383,66 @@ class Testiso5426(unittest2.TestCase):
         self.assertEqual(b'\xc5\xc8o'.decode("iso-5426-xe0"),
                          '\N{LATIN SMALL LETTER O WITH DIAERESIS AND MACRON}')
 
+    def test_buffers(self):
+        data = b"Benk\xcd\xc9o \xc5\xc7A \xc6m \xc8a"
+        expected = data.decode("mab2")
+        for buf in (bytearray(data), memoryview(data), memoryview(data)[:],
+                    array.array("B", data)):
+            self.assertEqual(iso5426.decode(buf), (expected, len(data)))
+            self.assertEqual(codecs.decode(buf, "mab2"), expected)
+        self.assertEqual(iso5426.decode(memoryview(b"xx" + data)[2:]),
+                         (expected, len(data)))
+        self.assertRaises(UnicodeError, iso5426.decode, memoryview(b"ab\xffcd"))
+        try:
+            iso5426.decode(memoryview(b"a\xff"))
+        except UnicodeError as e:
+            self.assertIn("(context b'a\\xff')", str(e))
+
+        with tempfile.TemporaryFile() as f:
+            for mab in TESTMABS:
+                with open(mab, "rb") as m:
+                    f.write(m.read())
+            f.flush()
+            f.seek(0)
+            expected = f.read().decode("mab2")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.assertEqual(iso5426.decode(mm)[0], expected)
+                view = memoryview(mm)
+                self.assertEqual(iso5426.decode(view[:100])[0], expected[:100])
+                view.release()
+            finally:
+                mm.close()
+
+    def test_encode_into(self):
+        buf = bytearray(b"xx")
+        self.assertEqual(iso5426.encode_into("abcä", buf), (5, 4))
+        self.assertEqual(buf, b"xxabc\xc8a")
+        self.assertEqual(iso5426.encode_into("o\u0308\u0301", buf), (3, 3))
+        self.assertEqual(buf, b"xxabc\xc8a\xc8\xc2o")
+        # combining chars without base char
+        self.assertEqual(iso5426.encode_into("\u0308\u0301a", buf), (3, 3))
+        self.assertEqual(buf[-3:], b"\xc2\xc8a")
+        self.assertEqual(iso5426.encode_into("", buf), (0, 0))
+        self.assertEqual(iso5426.encode_into("\u0444\u0308", buf, "ignore"), (1, 2))
+        self.assertEqual(buf[-1:], b"\xc8")
+        self.assertEqual(iso5426.encode_into("\u0444\u0308", buf, "replace"), (2, 2))
+        self.assertEqual(buf[-2:], b"\xc8?")
+        self.assertRaises(UnicodeError, iso5426.encode_into, "\u0444", buf)
+        self.assertRaises(ValueError, iso5426.encode_into, "a", buf, "repr")
+        # latin-1 chars without or with a different ISO-5426 byte
+        self.assertRaises(UnicodeError, iso5426.encode_into, "a\x00", buf)
+        self.assertEqual(iso5426.encode("$\xe4")[0], iso5426.unicodemap["$"] + b"\xc8a")
+        for uni, char in iso5426.unicodemap.items():
+            if uni not in iso5426._reorder:
+                self.assertEqual(iso5426.encode("x" + uni)[0], b"x" + char)
+        for mab in TESTMABS:
+            with open(mab, "rb") as f:
+                text = f.read().decode("mab2")
+            buf = bytearray()
+            iso5426.encode_into(text, buf)
+            self.assertEqual(bytes(buf), text.encode("mab2"))
+
     def test_unknown_encoding(self):
         self.assertRaises(LookupError, "a".encode, "invalid")
 
@@ -146,12 +1469,51 @@ class TestMarc(unittest2.TestCase):
         self.assertEqual(b"\xff".decode("marc", "repr"), '\\xff')
         self.assertEqual(b'\xe5\xe80'.decode('marc'), '\u0304\u03080')
 
+    def test_encode_into(self):
+        buf = bytearray()
+        self.assertEqual(marc.encode_into("abcä", buf), (5, 4))
+        self.assertEqual(marc.encode_into("\u1ead", buf), (3, 1))
+        self.assertEqual(buf, b"abc\xe8a\xe3\xf2a")
+        self.assertEqual(marc.encode_into("\u0444a", buf, "replace"), (2, 2))
+        self.assertEqual(buf[-2:], b"?a")
+        self.assertRaises(UnicodeError, marc.encode_into, "\u0444", buf)
+        self.assertRaises(UnicodeError, marc.encode_into, "a\x00", buf)
+        for uni, char in marc.unicodemap.items():
+            self.assertEqual(marc.encode(uni)[0], char)
+
+    def test_buffers(self):
+        data = b'abcdefg\xe8a\xe8o\xe8u\xe3\xf2a\xe5\xe80'
+        expected = data.decode("marc")
+        for buf in (bytearray(data), memoryview(data), array.array("B", data)):
+            self.assertEqual(marc.decode(buf), (expected, len(data)))
+        self.assertEqual(codecs.getincrementaldecoder("marc")().decode(
+            memoryview(data), True), expected)
+
 
 def test_main():
     suite = unittest2.TestSuite()
     suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(Testiso5426))
     suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestMarc))
     suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestBibencodingUtils))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestIncrementalDecoder))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestAsyncStream))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestValidate))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestDetect))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestRecords))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestStats))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestCache))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestWriters))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestParallel))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestIndex))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestCompression))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestFuzz))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestCorpus))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestCanonical))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestFingerprint))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestUTF8))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestVariants))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestSharedTables))
+    suite.addTest(unittest2.defaultTestLoader.loadTestsFromTestCase(TestTextIO))
     return suite
 
 if __name__ == "__main__": # pragma: no cover
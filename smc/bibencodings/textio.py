@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : buffered text files
+#=============================================================================
+"""buffered text files
+
+open() returns an io.TextIOWrapper for MAB2 and MARC files. The wrapper
+decodes blocks of blocksize bytes at once with the incremental decoder of
+the codec and splits lines in C, codecs.open() goes through the generic
+StreamReader instead::
+
+    with smc.bibencodings.open("dump.mab") as f:
+        for line in f:
+            ...
+
+benchmark() compares the speed of iterating over the lines of a file with
+codecs.open().
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+import io
+from timeit import default_timer
+
+# bytes per decode call
+BLOCKSIZE = 1 << 20
+
+
+class TextIOWrapper(io.TextIOWrapper):
+    """io.TextIOWrapper that writes the chars kept by the encoder on flush()
+
+    The wrapper never calls the encoder with final=True, an empty write()
+    makes the encoder emit its pending chars. tell(), seek() and close()
+    call flush().
+    """
+
+    def flush(self):
+        if not self.closed and self.writable():
+            io.TextIOWrapper.write(self, "")
+        io.TextIOWrapper.flush(self)
+
+
+def open(file, mode='r', encoding='mab2', errors='strict', newline=None,
+         buffering=-1, blocksize=BLOCKSIZE):
+    """Open a text file like io.open() with a bibliographic encoding
+
+    mode is r, w, a or x, optionally with + and t. buffering=1 selects line
+    buffering. blocksize is the number of bytes that are decoded at once.
+    Combining chars are moved in front of their base char, also across
+    write() calls: the encoder keeps the last char of a write() until the
+    next write(), flush() or close().
+    """
+    if "b" in mode:
+        raise ValueError("binary mode is not supported: %s" % mode)
+    # raises LookupError for unknown encodings
+    codecs.lookup(encoding)
+    if buffering == 0:
+        raise ValueError("can't have unbuffered text I/O")
+    raw = io.open(file, mode.replace("t", "") + "b",
+                  -1 if buffering == 1 else buffering)
+    try:
+        text = TextIOWrapper(raw, encoding, errors, newline,
+                                line_buffering=buffering == 1)
+    except Exception:
+        raw.close()
+        raise
+    # the wrapper reads and decodes chunks of this size
+    text._CHUNK_SIZE = blocksize
+    text.mode = mode
+    return text
+
+
+def benchmark(filename, encoding='mab2', repeat=3):
+    """Iterate over the lines of a file with open() and codecs.open()
+
+    Returns a list of (name, lines, MB/s).
+    """
+    with io.open(filename, "rb") as f:
+        size = len(f.read())
+    results = []
+    for name, opener in (("open", open), ("codecs.open", codecs.open)):
+        best = None
+        for _ in range(repeat):
+            start = default_timer()
+            with opener(filename, "r", encoding) as f:
+                lines = sum(1 for line in f)
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((name, lines, size / best / 1e6))
+    return results
+
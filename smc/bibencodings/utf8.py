@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : direct UTF-8 output
+#=============================================================================
+"""direct UTF-8 output
+
+to_utf8() converts MAB2 and MARC data to UTF-8 bytes with precompiled
+transcode tables, the result equals data.decode(encoding).encode("utf-8")
+but no text is created::
+
+    to_utf8(b"\\xc8a", "mab2") == b"\\xc3\\xa4"
+
+UTF8Transcoder and transcode_file() do the same for streams, combining
+prefixes at the end of a block are kept until their base char arrives.
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+import os
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings.compression import open_compressed
+from smc.bibencodings.utils import combining_tail
+
+# U+FFFD, the replacement char of the decoders
+REPLACEMENT = "\ufffd".encode("utf-8")
+
+# codec name -> transcode function, table factory, combining prefixes
+_codecs = {
+    'iso-5426': (iso5426.transcode,
+                 lambda: iso5426.transcode_tables(_encode),
+                 iso5426._combining),
+    'iso-5426-xe0': (iso5426.transcode,
+                     lambda: iso5426.transcode_tables(
+                         _encode, iso5426.special_xe0_map),
+                     iso5426._combining),
+    'marc': (marc.transcode,
+             lambda: marc.transcode_tables(_encode),
+             marc._combining),
+    }
+
+_tables = {}
+
+
+def _encode(text):
+    return text.encode("utf-8")
+
+
+def _lookup(encoding):
+    name = codecs.lookup(encoding).name
+    if name not in _codecs:
+        raise LookupError("Unsupported encoding %s" % encoding)
+    return name, _codecs[name]
+
+
+def utf8_tables(encoding):
+    """Return the cached UTF-8 transcode tables of a codec
+    """
+    name, (transcode, factory, combining) = _lookup(encoding)
+    tables = _tables.get(name)
+    if tables is None:
+        tables = _tables[name] = factory()
+    return tables
+
+
+def to_utf8(data, encoding='mab2', errors='strict'):
+    """Convert data to UTF-8 bytes
+
+    data can be any object with buffer interface. errors works like for
+    decode(), replace writes U+FFFD.
+    """
+    name, (transcode, factory, combining) = _lookup(encoding)
+    return transcode(data, utf8_tables(name), errors, REPLACEMENT)[0]
+
+
+class UTF8Transcoder(object):
+    """Incremental conversion to UTF-8 bytes
+    """
+
+    def __init__(self, encoding='mab2', errors='strict'):
+        name, (transcode, factory, combining) = _lookup(encoding)
+        self.errors = errors
+        self._transcode = transcode
+        self._tables = utf8_tables(name)
+        self._combining = combining
+        self._pending = b""
+
+    def transcode(self, data, final=False):
+        """Convert a chunk, returns the UTF-8 bytes of the complete chars
+        """
+        if self._pending:
+            data = self._pending + bytes(data)
+        if final:
+            tail = 0
+        else:
+            tail = combining_tail(data, self._combining)
+        end = len(data) - tail
+        self._pending = bytes(data[end:])
+        return self._transcode(memoryview(data)[:end], self._tables,
+                               self.errors, REPLACEMENT)[0]
+
+    def reset(self):
+        self._pending = b""
+
+
+def transcode_file(source, target, encoding='mab2', errors='strict',
+                   blocksize=1 << 20):
+    """Convert a binary stream to UTF-8 and write it to target
+
+    source is a binary file or a file name (compressed files are read
+    transparently), target is a binary file. Returns (bytes read, bytes
+    written).
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open_compressed(source) as f:
+            return transcode_file(f, target, encoding, errors, blocksize)
+    transcoder = UTF8Transcoder(encoding, errors)
+    read = written = 0
+    while True:
+        data = source.read(blocksize)
+        if not data:
+            break
+        read += len(data)
+        result = transcoder.transcode(data)
+        target.write(result)
+        written += len(result)
+    result = transcoder.transcode(b"", True)
+    target.write(result)
+    return read, written + len(result)
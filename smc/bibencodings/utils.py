@@ -12,13 +12,187 @@
 """help functions
 """
 from __future__ import unicode_literals, print_function
+import codecs
+import os
+from smc.bibencodings.compression import open_compressed
+
+# end of record marker of MAB2 and MARC (ISO 2709) records
+RECORD_TERMINATOR = b'\x1d'
+
+# byte value to single byte string
+bytechr = [bytes(bytearray([i])) for i in range(256)]
+
+
+class CharTables(object):
+    """Lookup tables keyed by byte values
+
+    single: list of 256 chars from the charmap
+    double, triple: dicts of two and three byte sequences, the key is the
+      big endian integer of the bytes, e.g. 0xc861 for b'\xc8a'
+    fallback: like single, entries of the special map take precedence
+    special: list of 256 chars from the special map
+    """
+
+    __slots__ = ("single", "double", "triple", "fallback", "special")
+    def __init__(self, charmap, special=None):
+        self.single = [None] * 256
+        self.double = {}
+        self.triple = {}
+        self.special = [None] * 256
+        for key, value in charmap.items():
+            key = bytearray(key)
+            if len(key) == 1:
+                self.single[key[0]] = value
+            elif len(key) == 2:
+                self.double[(key[0] << 8) | key[1]] = value
+            elif len(key) == 3:
+                self.triple[(key[0] << 16) | (key[1] << 8) | key[2]] = value
+            else:
+                raise ValueError(key)
+        if special is not None:
+            for key, value in special.items():
+                self.special[ord(key)] = value
+        self.fallback = [s if s is not None else c
+                         for c, s in zip(self.single, self.special)]
+
+
+class EncodeTables(object):
+    """Lookup tables of an encoder
+
+    unicodemap: dict of char -> bytes
+    reorder: chars that are moved in front of the previous char
+    translate: str.translate table of the other chars to their bytes as
+      latin-1 text. Unmapped latin-1 chars and reorder chars become a lone
+      surrogate, the latin-1 encoding of such a translation fails.
+    """
+
+    __slots__ = ("unicodemap", "reorder", "translate")
+    def __init__(self, unicodemap, reorder=()):
+        self.unicodemap = unicodemap
+        self.reorder = frozenset(reorder)
+        self.translate = dict.fromkeys(range(256), "\ud800")
+        self.translate.update((ord(uni), char.decode("latin-1"))
+                              for uni, char in unicodemap.items()
+                              if uni not in self.reorder)
+
+
+class BufferedIncrementalEncoder(codecs.IncrementalEncoder):
+    """Incremental encoder that moves combining chars across inputs
+
+    The encoders move combining chars in front of the char before them. The
+    last char of an input and its combining chars are kept until the next
+    input, so a combining char from a later write() is moved, too. Line
+    breaks and unmapped chars aren't kept. final=True or an empty input
+    emit the kept chars: io.TextIOWrapper never passes final=True, the text
+    files of smc.bibencodings.open() write an empty string on flush().
+
+    Subclasses implement _tables() (EncodeTables) and _encode_into().
+    """
+
+    def __init__(self, errors='strict'):
+        codecs.IncrementalEncoder.__init__(self, errors)
+        self.pending = ""
+
+    def encode(self, input, final=False):
+        tables = self._tables()
+        text = self.pending + input
+        self.pending = ""
+        reorder = tables.reorder
+        if input and not final and reorder:
+            pos = len(text)
+            while pos > 0 and text[pos - 1] in reorder:
+                pos -= 1
+            if pos > 0 and text[pos - 1] not in "\r\n":
+                pos -= 1
+            uget = tables.unicodemap.get
+            if all(uget(u) is not None for u in text[pos:]):
+                self.pending = text[pos:]
+                text = text[:pos]
+        buffer = bytearray()
+        self._encode_into(text, buffer, self.errors, tables)
+        return bytes(buffer)
+
+    def reset(self):
+        self.pending = ""
+
+    def getstate(self):
+        # the kept text as integer, a leading 1 byte keeps NUL chars
+        if not self.pending:
+            return 0
+        return int.from_bytes(b"\x01" + self.pending.encode("utf-8"), "big")
+
+    def setstate(self, state):
+        if not state:
+            self.pending = ""
+        else:
+            data = state.to_bytes((state.bit_length() + 7) // 8, "big")
+            self.pending = data[1:].decode("utf-8")
+
+
+def byteview(data):
+    """Flat memoryview of unsigned bytes for any buffer
+    """
+    data = memoryview(data)
+    if data.format != "B" or data.ndim != 1:
+        data = data.cast("B")
+    return data
+
+
+def combining_tail(data, combining):
+    """Count trailing combining prefix bytes
+
+    Combining chars are written in front of the char they modify. A decoder
+    that sees them at the end of a chunk must wait for more data.
+    """
+    end = pos = len(data)
+    while pos > 0 and data[pos - 1] in combining:
+        pos -= 1
+    return end - pos
+
+
+def iter_records(stream, terminator=RECORD_TERMINATOR, blocksize=65536):
+    """Iterate over the records of a binary stream
+
+    Records keep their terminator. Trailing data without terminator is
+    returned as last record. stream may also be a file name, compressed
+    files are decompressed in a background thread (see compression).
+    """
+    if isinstance(stream, (str, os.PathLike)):
+        with open_compressed(stream) as f:
+            for record in iter_records(f, terminator, blocksize):
+                yield record
+        return
+    read = stream.read
+    pending = b""
+    while True:
+        block = read(blocksize)
+        if not block:
+            break
+        data = pending + block if pending else block
+        find = data.find
+        start = 0
+        while True:
+            end = find(terminator, start)
+            if end == -1:
+                break
+            end += len(terminator)
+            yield data[start:end]
+            start = end
+        pending = data[start:]
+    if pending:
+        yield pending
+
 
 class DecodeIterator(object):
     """Decoding iterator with peek and evolve
+
+    Works on any object with buffer interface (bytes, bytearray, memoryview,
+    mmap) without copying it and yields byte values as int.
     """
 
     __slots__ = ("_data", "_length", "_pos")
     def __init__(self, data):
+        data = byteview(data)
         self._data = data
         self._length = len(data)
         self._pos = 0
@@ -27,7 +201,7 @@ class DecodeIterator(object):
         while True:
             pos = self._pos
             if pos >= self._length:
-                raise StopIteration
+                return
             yield self._data[pos]
             self._pos += 1
 
@@ -41,6 +215,11 @@ class DecodeIterator(object):
     def position(self):
         return self._pos
 
+    def context(self, pos, size=3):
+        """Bytes around pos for error messages
+        """
+        return self._data[max(pos - size, 0):pos + size].tobytes()
+
     def peek(self, amount=2):
         nextpos = self._pos + 1
         result = list(self._data[nextpos:nextpos + amount])
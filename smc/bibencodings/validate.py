@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : validation of encoded data
+#=============================================================================
+"""validation of encoded data
+
+The validators check bytes against the charmap tables of a codec without
+decoding them. The decoders only fail on single bytes that have no mapping:
+every multi byte sequence in the tables consists of valid bytes and a
+combining char without a matching sequence is decoded on its own. It's
+therefore sufficient to look for invalid bytes, which is done in C with
+bytes.translate().
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+import re
+from collections import namedtuple
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings.utils import combining_tail, iter_records
+from smc.bibencodings.utils import RECORD_TERMINATOR
+
+RecordReport = namedtuple("RecordReport", "index offset length errors")
+
+
+class Validator(object):
+    """Validate bytes against a charmap
+
+    ascii: bytes below are decoded as ASCII
+    nonfinal: bytes without mapping that are only valid in front of another
+      byte, they are verified with *decode*
+    """
+
+    def __init__(self, charmap, special=None, ascii=0x80, nonfinal=b"",
+                 combining=(), decode=None):
+        valid = set(range(ascii))
+        for tables in (charmap, special or {}):
+            valid.update(ord(c) for c in tables if len(c) == 1)
+        valid.update(bytearray(nonfinal))
+        self.valid = bytes(bytearray(sorted(valid)))
+        self.invalid = bytes(bytearray(sorted(set(range(256)) - valid)))
+        self.nonfinal = nonfinal
+        self.combining = combining
+        self.decode = decode
+        if self.invalid:
+            self._search = re.compile(b"[" + re.escape(self.invalid) + b"]")
+        else:
+            self._search = None
+
+    def _invalid_final(self, data):
+        last = data[-1:]
+        if not last or last not in self.nonfinal:
+            return False
+        # a run of combining chars starts on a char boundary
+        start = len(data) - combining_tail(data, self.combining)
+        text = self.decode(data[start:], "repr")[0]
+        return text.endswith("\\x%x" % ord(last))
+
+    def is_valid(self, data):
+        """Check if data can be decoded without errors
+        """
+        data = bytes(data)
+        if data.translate(None, self.valid):
+            return False
+        return not self._invalid_final(data)
+
+    def errors(self, data):
+        """Return a list of (position, byte) for all undecodable bytes
+        """
+        data = bytes(data)
+        result = []
+        if self._search is not None and data.translate(None, self.valid):
+            result.extend((m.start(), m.group())
+                          for m in self._search.finditer(data))
+        if self._invalid_final(data):
+            result.append((len(data) - 1, data[-1:]))
+        return result
+
+
+class RecordValidator(object):
+    """Validate records and collect error statistics
+
+    errorcounts maps undecodable bytes to the number of occurrences.
+    """
+
+    def __init__(self, encoding='mab2'):
+        self.validator = get_validator(encoding)
+        self.records = 0
+        self.invalid_records = 0
+        self.bytes = 0
+        self.errors = 0
+        self.errorcounts = {}
+
+    def validate(self, record, offset=0):
+        """Validate one record, returns a RecordReport or None
+        """
+        index = self.records
+        self.records += 1
+        self.bytes += len(record)
+        errors = self.validator.errors(record)
+        if not errors:
+            return None
+        self.invalid_records += 1
+        self.errors += len(errors)
+        counts = self.errorcounts
+        for pos, c in errors:
+            counts[c] = counts.get(c, 0) + 1
+        return RecordReport(index, offset, len(record), errors)
+
+    def scan(self, stream, terminator=RECORD_TERMINATOR, blocksize=65536):
+        """Validate all records of a binary stream
+
+        Yields a RecordReport for every record with undecodable bytes.
+        """
+        offset = 0
+        validate = self.validate
+        for record in iter_records(stream, terminator, blocksize):
+            report = validate(record, offset)
+            if report is not None:
+                yield report
+            offset += len(record)
+
+
+_validators = {}
+
+
+def get_validator(encoding):
+    """Get a cached validator for a codec name
+    """
+    name = codecs.lookup(encoding).name
+    validator = _validators.get(name)
+    if validator is not None:
+        return validator
+    # 0xc9 is an alias of combining diaeresis 0xc8 but has no mapping
+    # on its own
+    if name == iso5426.codecInfo.name:
+        validator = Validator(iso5426.charmap, None, 0x7f, b'\xc9',
+                              iso5426._combining, iso5426.decode)
+    elif name == iso5426.specialXE0CodecInfo.name:
+        validator = Validator(iso5426.charmap, iso5426.special_xe0_map, 0x7f,
+                              b'\xc9', iso5426._combining,
+                              iso5426.specialXE0CodecInfo.decode)
+    elif name == marc.codecInfo.name:
+        validator = Validator(marc.charmap)
+    else:
+        raise LookupError("No validator for encoding %s" % encoding)
+    _validators[name] = validator
+    return validator
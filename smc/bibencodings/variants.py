@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : codec variants
+#=============================================================================
+"""codec variants
+
+Some systems deviate from the standards in a few chars. register_variant()
+adds a named codec that overlays the charmap of iso5426 or marc with such
+deviations::
+
+    register_variant("mab2-opac", "mab2", charmap={b"\\xa4": "\\u20ac"})
+    b"\\xa4".decode("mab2-opac") == "\\u20ac"
+    "\\u20ac".encode("mab2-opac") == b"\\xa4"
+
+The overlay is merged into copies of the base maps and compiled into
+CharTables and EncodeTables once, the variant uses the decode and encode
+functions of the base codec with these tables. The base codec is never
+modified. charmap entries with the value None remove a sequence. The
+encoder learns the single chars of the charmap overlay, the unicodemap
+overlay (char -> bytes or None) takes precedence. A char whose sequence is
+replaced is encoded with another sequence that decodes to it, ASCII chars
+with their ASCII byte. Sequences of two or three bytes start with
+combining chars, the decoder doesn't look up other sequences.
+"""
+from __future__ import unicode_literals, print_function
+import codecs
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings.utils import CharTables, EncodeTables, combining_tail
+from smc.bibencodings.utils import BufferedIncrementalEncoder
+
+# the decoder looks up 0xc9 as 0xc8
+_iso5426_prefixes = frozenset(iso5426._combining - set([0xc9]))
+
+# codec name -> codec module, special map, combining chars are reordered,
+# bytes in front of the last byte of a sequence
+_bases = {
+    'iso-5426': (iso5426, None, True, _iso5426_prefixes),
+    'iso-5426-xe0': (iso5426, iso5426.special_xe0_map, True,
+                     _iso5426_prefixes),
+    'marc': (marc, None, False, frozenset(marc._combining)),
+    }
+
+_variants = {}
+
+
+def _normalize(name):
+    return name.lower().replace('_', '-')
+
+
+class CodecVariant(object):
+    """A codec with overlay tables on top of a base codec
+    """
+
+    def __init__(self, name, base, charmap=None, unicodemap=None,
+                 special=None):
+        basename = codecs.lookup(base).name
+        if basename not in _bases:
+            raise LookupError("Unsupported base encoding %s" % base)
+        self.name = name
+        self.base = basename
+        module, basespecial, reorder, prefixes = _bases[basename]
+        self.module = module
+        self.charmap = dict(module.charmap)
+        self.unicodemap = dict(module.unicodemap)
+        charmap = charmap or {}
+        replaced = []
+        for key, value in charmap.items():
+            if (not key or len(key) > 3 or not module._nonascii.match(key) or
+                    not prefixes.issuperset(bytearray(key[:-1]))):
+                raise ValueError("Invalid sequence %r" % key)
+            old = self.charmap.pop(key, None)
+            if old is not None:
+                replaced.append(old)
+            if value is not None:
+                self.charmap[key] = value
+        # the chars of the old sequences must not encode to them anymore
+        for old in replaced:
+            if (len(old) == 1 and
+                    self.charmap.get(self.unicodemap.get(old)) != old):
+                self.unicodemap.pop(old, None)
+                other = self._sequence(old)
+                if other is not None:
+                    self.unicodemap[old] = other
+        for key, value in charmap.items():
+            if value is not None and len(value) == 1:
+                self.unicodemap[value] = key
+        for key, value in (unicodemap or {}).items():
+            if len(key) != 1:
+                raise ValueError("Invalid char %r" % key)
+            if value is None:
+                self.unicodemap.pop(key, None)
+            else:
+                self.unicodemap[key] = value
+        if special is None:
+            special = basespecial
+        elif basespecial is not None:
+            merged = dict(basespecial)
+            merged.update(special)
+            special = merged
+        self.special = special
+        self.tables = CharTables(self.charmap, special)
+        if reorder:
+            reorder = [uni for uni, char in self.unicodemap.items()
+                       if len(char) == 1 and ord(char) in module._combining]
+        else:
+            reorder = ()
+        self.encode_tables = EncodeTables(self.unicodemap, reorder)
+        # text files also need line breaks
+        self.text_encode_tables = EncodeTables(
+            dict(self.unicodemap, **{"\n": b"\n", "\r": b"\r"}), reorder)
+        self.codecInfo = codecs.CodecInfo(
+            name=name,
+            encode=self.encode,
+            decode=self.decode,
+            incrementalencoder=self.incrementalencoder,
+            incrementaldecoder=self.incrementaldecoder,
+            streamreader=self.streamreader,
+            streamwriter=self.streamwriter)
+
+    def _sequence(self, char):
+        """Return another sequence that decodes to char or None
+        """
+        if ord(char) < 0x80:
+            ascii = char.encode("ascii")
+            if not self.module._nonascii.match(ascii):
+                # ASCII chars are copied by the decoder
+                return ascii
+        candidates = [key for key, value in self.charmap.items()
+                      if value == char]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda key: (len(key), key))
+
+    def encode(self, input, errors='strict'):
+        buffer = bytearray()
+        self.module.encode_into(input, buffer, errors, self.encode_tables)
+        return bytes(buffer), len(input)
+
+    def encode_into(self, input, buffer, errors='strict'):
+        return self.module.encode_into(input, buffer, errors,
+                                       self.encode_tables)
+
+    def decode(self, input, errors='strict'):
+        return self.module.decode(input, errors, tables=self.tables)
+
+    def incrementalencoder(self, errors='strict'):
+        return VariantIncrementalEncoder(self, errors)
+
+    def incrementaldecoder(self, errors='strict'):
+        return VariantIncrementalDecoder(self, errors)
+
+    def streamreader(self, stream, errors='strict'):
+        return VariantStreamReader(self, stream, errors)
+
+    def streamwriter(self, stream, errors='strict'):
+        return VariantStreamWriter(self, stream, errors)
+
+
+class VariantIncrementalEncoder(BufferedIncrementalEncoder):
+
+    def __init__(self, variant, errors='strict'):
+        BufferedIncrementalEncoder.__init__(self, errors)
+        self.variant = variant
+
+    def _tables(self):
+        return self.variant.text_encode_tables
+
+    def _encode_into(self, input, buffer, errors, tables):
+        return self.variant.module.encode_into(input, buffer, errors, tables)
+
+
+class VariantIncrementalDecoder(codecs.BufferedIncrementalDecoder):
+
+    def __init__(self, variant, errors='strict'):
+        codecs.BufferedIncrementalDecoder.__init__(self, errors)
+        self.variant = variant
+
+    def _buffer_decode(self, input, errors, final):
+        if not final:
+            # keep trailing combining chars until their base char arrives
+            combining = self.variant.module._combining
+            input = input[:len(input) - combining_tail(input, combining)]
+        return self.variant.decode(input, errors)
+
+
+class VariantStreamReader(codecs.StreamReader):
+
+    def __init__(self, variant, stream, errors='strict'):
+        codecs.StreamReader.__init__(self, stream, errors)
+        self.decode = variant.decode
+
+
+class VariantStreamWriter(codecs.StreamWriter):
+
+    def __init__(self, variant, stream, errors='strict'):
+        codecs.StreamWriter.__init__(self, stream, errors)
+        self.encode = variant.encode
+
+
+def register_variant(name, base, charmap=None, unicodemap=None,
+                     special=None):
+    """Register a codec variant, returns the CodecVariant
+
+    base is the name of the base codec (mab2, mab2-xe0 or marc). The name
+    can't be changed or removed once it's registered, codecs caches
+    lookups.
+    """
+    key = _normalize(name)
+    if key in _variants:
+        raise ValueError("Variant %s is already registered" % name)
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        pass
+    else:
+        raise ValueError("Encoding %s already exists" % name)
+    variant = CodecVariant(key, base, charmap, unicodemap, special)
+    _variants[key] = variant
+    return variant
+
+
+def get_variant(name):
+    """Return a registered CodecVariant or None
+    """
+    return _variants.get(_normalize(name))
+
+
+def search_func(encoding):
+    variant = _variants.get(_normalize(encoding))
+    if variant is not None:
+        return variant.codecInfo
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#=============================================================================
+# Copyright   : (c)2010-2012 semantics GmbH
+# Rep./File   : $URL$
+# Date        : $Date$
+# Author      : Christian Heimes
+# License     : BSD LICENSE
+# Worker      : $Author$
+# Revision    : $Rev$
+# Purpose     : record writers
+#=============================================================================
+"""record writers
+
+The writers encode field values directly into one growing output buffer.
+The record length in the leader (and the MARC directory) is filled in after
+the record has been encoded, so every record is encoded in a single pass::
+
+    with open("export.mab", "wb") as f:
+        writer = MAB2Writer(f)
+        writer.write([("001", " ", "HT016189653"),
+                      ("331", " ", "Orgelbüchlein")])
+        writer.flush()
+"""
+from __future__ import unicode_literals, print_function
+from smc.bibencodings import iso5426
+from smc.bibencodings import marc
+from smc.bibencodings.records import FIELD_TERMINATOR, MAB2_LEADER_SIZE
+from smc.bibencodings.records import MARC_LEADER_SIZE
+from smc.bibencodings.utils import RECORD_TERMINATOR
+
+MAB2_LEADER = "00000nM2.01200024      h"
+MARC_LEADER = "00000nam  2200000   4500"
+MAX_RECORD_SIZE = 99999
+MAX_FIELD_SIZE = 9999
+SUBFIELD_DELIMITER = b'\x1f'
+
+
+def utf8_encode_into(input, buffer, errors='strict'):
+    """Encode unicode as UTF-8 and append it to a bytearray
+    """
+    data = input.encode("utf-8", errors)
+    buffer += data
+    return len(data), len(input)
+
+
+class _RecordWriter(object):
+    """Buffered record writer
+
+    Records are collected in a buffer and written once the buffer exceeds
+    *buffersize* bytes. Call flush() or close() when you are done.
+    Subclasses implement write(fields), which encodes one record.
+    """
+
+    def __init__(self, stream, errors='strict', buffersize=1 << 20):
+        self.stream = stream
+        self.errors = errors
+        self.buffersize = buffersize
+        self.records = 0
+        self._buffer = bytearray()
+
+    def writemany(self, records):
+        """Write an iterable of field lists, returns number of records
+        """
+        count = 0
+        write = self.write
+        for fields in records:
+            write(fields)
+            count += 1
+        return count
+
+    def flush(self):
+        """Write buffered records to the stream
+        """
+        buf = self._buffer
+        if buf:
+            self.stream.write(buf)
+            del buf[:]
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MAB2Writer(_RecordWriter):
+    """Write MAB2 records in diskette format to a binary stream
+    """
+
+    def __init__(self, stream, errors='strict', buffersize=1 << 20,
+                 encode_into=iso5426.encode_into):
+        _RecordWriter.__init__(self, stream, errors, buffersize)
+        self._encode_into = encode_into
+
+    def write(self, fields, leader=MAB2_LEADER):
+        """Encode and write one record
+
+        fields is an iterable of (tag, indicator, value) tuples. The record
+        length in the leader is updated. Returns the record length.
+        """
+        if len(leader) != MAB2_LEADER_SIZE:
+            raise ValueError("Invalid leader %r" % leader)
+        buf = self._buffer
+        begin = len(buf)
+        encode_into = self._encode_into
+        errors = self.errors
+        try:
+            buf += leader.encode("ascii")
+            for tag, indicator, value in fields:
+                if len(tag) != 3 or len(indicator) != 1:
+                    raise ValueError("Invalid tag %r or indicator %r" %
+                                     (tag, indicator))
+                if "\x1e" in value or "\x1d" in value:
+                    raise ValueError("Field %s contains a separator" % tag)
+                buf += (tag + indicator).encode("ascii")
+                encode_into(value, buf, errors)
+                buf += FIELD_TERMINATOR
+            buf += RECORD_TERMINATOR
+            length = len(buf) - begin
+            if length > MAX_RECORD_SIZE:
+                raise ValueError("Record is too long: %i bytes" % length)
+        except BaseException:
+            # drop the partial record
+            del buf[begin:]
+            raise
+        buf[begin:begin + 5] = b"%05i" % length
+        self.records += 1
+        if len(buf) >= self.buffersize:
+            self.flush()
+        return length
+
+
+class MARCWriter(_RecordWriter):
+    """Write MARC 21 records in ISO 2709 format to a binary stream
+
+    Fields are encoded as MARC-8 with the marc codec or as UTF-8 when
+    leader/09 is 'a', unless an encode_into function is given.
+    """
+
+    def __init__(self, stream, errors='strict', buffersize=1 << 20,
+                 encode_into=None):
+        _RecordWriter.__init__(self, stream, errors, buffersize)
+        self._encode_into = encode_into
+        self._directory = bytearray()
+        self._data = bytearray()
+
+    def write(self, fields, leader=MARC_LEADER):
+        """Encode and write one record
+
+        fields is an iterable of (tag, indicators, value) tuples. indicators
+        is an empty string for control fields 001 to 009 and two ASCII chars
+        for other fields, value contains the subfield delimiters (0x1f).
+        Returns the record length.
+        """
+        if len(leader) != MARC_LEADER_SIZE:
+            raise ValueError("Invalid leader %r" % leader)
+        if self._encode_into is not None:
+            encode_into = self._encode_into
+        elif leader[9] == "a":
+            encode_into = utf8_encode_into
+        else:
+            encode_into = marc.encode_into
+        errors = self.errors
+        # directory and field data are built side by side in reused buffers
+        directory = self._directory
+        data = self._data
+        del directory[:]
+        del data[:]
+        for tag, indicators, value in fields:
+            if len(tag) != 3:
+                raise ValueError("Invalid tag %r" % tag)
+            # control fields 001 to 009 have no indicators
+            if tag.startswith("00"):
+                valid = not indicators
+            else:
+                valid = len(indicators) == 2 and max(indicators) < "\x80"
+            if not valid:
+                raise ValueError("Invalid indicators %r for tag %s" %
+                                 (indicators, tag))
+            if "\x1e" in value or "\x1d" in value:
+                raise ValueError("Field %s contains a separator" % tag)
+            start = len(data)
+            data += indicators.encode("ascii")
+            encode_into(value, data, errors)
+            data += FIELD_TERMINATOR
+            length = len(data) - start
+            if length > MAX_FIELD_SIZE:
+                raise ValueError("Field %s is too long: %i bytes" %
+                                 (tag, length))
+            directory += b"%s%04i%05i" % (tag.encode("ascii"), length, start)
+        base = MARC_LEADER_SIZE + len(directory) + 1
+        length = base + len(data) + 1
+        if length > MAX_RECORD_SIZE:
+            raise ValueError("Record is too long: %i bytes" % length)
+        leader = leader.encode("ascii")
+        buf = self._buffer
+        buf += b"%05i" % length
+        buf += leader[5:12]
+        buf += b"%05i" % base
+        buf += leader[17:]
+        buf += directory
+        buf += FIELD_TERMINATOR
+        buf += data
+        buf += RECORD_TERMINATOR
+        self.records += 1
+        if len(buf) >= self.buffersize:
+            self.flush()
+        return length